@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""Benchmark mergic on the RLdata and tennis fixtures.
+
+Times calc and make on the fixtures and on bigger copies of them, and
+diff, apply, table and join on partitions made of many copies of the tennis
+groupings. Each group of tasks runs in its own process, so that peak
+memory can be measured for it. Before timing anything, the tennis
+results are checked against the committed groups.json, diff.json,
+rebuilt.json and merge.csv.
+
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, root)
+
+from mergic import mergic
+
+
+def first_initial_last(name):
+    initial = re.match("^[A-Z]", name).group()
+    last = re.search("(?<=[ .])[A-Z].+$", name).group()
+    return "{}. {}".format(initial, last)
+
+
+# How to read each fixture, make a Blender for it, and the cutoff to
+# make partitions at.
+fixtures = {
+    'tennis': (os.path.join(root, 'tennis', 'names.txt'),
+               lambda: mergic.Blender('levenshtein',
+                                      preprocess=first_initial_last,
+                                      memo=True, cache_dir=None),
+               2),
+    'rldata': (os.path.join(root, 'RLdata', 'RLdata500.csv'),
+               lambda: mergic.Blender('levenshtein', cache_dir=None),
+               2),
+}
+
+
+def tennis_file(name):
+    return os.path.join(root, 'tennis', name)
+
+
+def read_partition(path):
+    with open(path, 'rb') as f:
+        return OrderedDict(mergic.read_partition(f))
+
+
+def perturb(line, rng):
+    """Change one letter of a line to another letter of the same case."""
+    letters = [i for i, c in enumerate(line) if c.isalpha()]
+    if not letters:
+        return line
+    i = rng.choice(letters)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz'
+    if line[i].isupper():
+        alphabet = alphabet.upper()
+    return line[:i] + rng.choice(alphabet) + line[i+1:]
+
+
+def lines_of(fixture, size):
+    """The first `size` lines of a fixture, extended by perturbed copies."""
+    with open(fixtures[fixture][0]) as f:
+        lines = [line.strip() for line in f]
+    rng = random.Random(size)
+    result = lines[:size]
+    while len(result) < size:
+        result.append(perturb(rng.choice(lines), rng))
+    return result
+
+
+def copies(partition, n):
+    """A partition of `n` copies of a partition, with numbered values."""
+    result = OrderedDict()
+    for k in range(n):
+        suffix = u' #{}'.format(k)
+        for key, values in partition.items():
+            result[key + suffix] = [value + suffix for value in values]
+    return result
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_calc(fixture, size, block):
+    """Time calc and make for lines of a fixture."""
+    items = lines_of(fixture, size)
+    _, make_blender, cutoff = fixtures[fixture]
+    blender = make_blender()
+    blender.blocker = mergic.blockers.get(block)
+    blender.stats = mergic.Stats()
+    _, calc_seconds = timed(blender.fit, items)
+
+    def make():
+        out = io.BytesIO()
+        mergic.write_groups(blender.partition(cutoff).items(), out)
+        return out
+
+    _, make_seconds = timed(make)
+    distance_calls = blender.stats.counts.get('distance_calls', 0)
+    return [('calc', size, calc_seconds, {'distance_calls': distance_calls}),
+            ('make', size, make_seconds, {})]
+
+
+def run_partitions(size):
+    """Time diff, apply, table and join for copies of the tennis partitions."""
+    groups = read_partition(tennis_file('groups.json'))
+    edited = read_partition(tennis_file('edited.json'))
+    n = max(1, size // sum(len(values) for values in groups.values()))
+    groups, edited = copies(groups, n), copies(edited, n)
+    items = sum(len(values) for values in groups.values())
+    patch, diff_seconds = timed(mergic.diff, groups, edited)
+    _, apply_seconds = timed(mergic.apply_diff, groups, patch)
+
+    def table():
+        out = io.BytesIO()
+        mergic.write_table(edited.items(), out)
+        return out
+
+    out, table_seconds = timed(table)
+
+    def join():
+        rows = csv.reader(io.BytesIO(out.getvalue()))
+        mergic.write_batches(mergic.batched(
+            mergic.join(edited.items(), rows, 'original')), io.BytesIO())
+
+    _, join_seconds = timed(join)
+    return [('diff', items, diff_seconds, {}),
+            ('apply', items, apply_seconds, {}),
+            ('table', items, table_seconds, {}),
+            ('join', items, join_seconds, {})]
+
+
+def run(task, fixture, size, block):
+    """Run a group of tasks in this process and return their results."""
+    if task == 'calc':
+        rows = run_calc(fixture, size, block)
+    else:
+        rows = run_partitions(size)
+    peak = peak_rss_kb()
+    results = []
+    for name, items, seconds, extra in rows:
+        result = OrderedDict([('task', name),
+                              ('fixture', fixture),
+                              ('items', items),
+                              ('seconds', seconds),
+                              ('items_per_second',
+                               items / seconds if seconds else None),
+                              ('peak_rss_kb', peak)])
+        result.update(extra)
+        results.append(result)
+    return results
+
+
+def run_apart(task, fixture, size, block):
+    """Run a group of tasks in a new process, for its own peak memory."""
+    command = [sys.executable, os.path.abspath(__file__), '--run', task,
+               fixture, str(size)]
+    if block is not None:
+        command += ['--block', block]
+    return json.loads(subprocess.check_output(command),
+                      object_pairs_hook=OrderedDict)
+
+
+def check():
+    """Check tennis results against the committed files.
+
+    Returns
+    -------
+    OrderedDict
+        Whether each check passed, by the name of the file checked.
+
+    """
+    checks = OrderedDict()
+    with open(fixtures['tennis'][0]) as f:
+        blender = fixtures['tennis'][1]().fit(mergic.read_items(f))
+    out = io.BytesIO()
+    mergic.write_groups(blender.partition(fixtures['tennis'][2]).items(), out)
+    with open(tennis_file('groups.json'), 'rb') as f:
+        checks['groups.json'] = out.getvalue() == f.read()
+    groups = read_partition(tennis_file('groups.json'))
+    edited = read_partition(tennis_file('edited.json'))
+    patch = read_partition(tennis_file('diff.json'))
+    checks['diff.json'] = mergic.equal(mergic.diff(groups, edited), patch)
+    mergic.apply_diff(groups, patch)
+    checks['rebuilt.json'] = mergic.equal(
+        groups, read_partition(tennis_file('rebuilt.json')))
+    rows = [[value.encode('utf-8') for value in row]
+            for row in mergic.table(edited)]
+    with open(tennis_file('merge.csv'), 'rb') as f:
+        checks['merge.csv'] = sorted(rows) == sorted(list(csv.reader(f))[1:])
+    return checks
+
+
+def compare(results, previous):
+    """Print how long each task took relative to previous results."""
+    before = {(r['task'], r['fixture'], r['items']): r['seconds']
+              for r in previous['results']}
+    print "task, fixture, items, seconds, before, ratio"
+    for r in results:
+        old = before.get((r['task'], r['fixture'], r['items']))
+        ratio = r['seconds'] / old if old else None
+        print "{}, {}, {}, {:.4f}, {}, {}".format(
+            r['task'], r['fixture'], r['items'], r['seconds'],
+            '' if old is None else '{:.4f}'.format(old),
+            '' if ratio is None else '{:.2f}'.format(ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--calc-sizes',
+                        help='comma-separated numbers of lines to time '
+                             'calc and make on (default: 0,500,1000,2000); '
+                             '0 means the whole fixture',
+                        default='0,500,1000,2000')
+    parser.add_argument('--sizes',
+                        help='comma-separated numbers of items to time '
+                             'diff, apply, table and join on '
+                             '(default: 10000,100000,1000000)',
+                        default='10000,100000,1000000')
+    parser.add_argument('--fixtures',
+                        help='comma-separated fixtures to time calc and '
+                             'make on (default: tennis,rldata)',
+                        default='tennis,rldata')
+    parser.add_argument('--block',
+                        help='a blocker to use for calc',
+                        choices=sorted(mergic.blockers.keys()))
+    parser.add_argument('--output',
+                        help='file to write results to as JSON '
+                             '(default: results.json)',
+                        default='results.json')
+    parser.add_argument('--compare',
+                        help='results from an earlier run to compare to',
+                        type=argparse.FileType('r'))
+    parser.add_argument('--run',
+                        help=argparse.SUPPRESS,
+                        nargs=3)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        task, fixture, size = args.run
+        print json.dumps(run(task, fixture, int(size), args.block))
+        return
+
+    checks = check()
+    for name, passed in checks.items():
+        print >> sys.stderr, '{}: {}'.format(name, 'ok' if passed else
+                                             'DIFFERENT')
+    results = []
+    for fixture in args.fixtures.split(','):
+        for size in args.calc_sizes.split(','):
+            size = int(size)
+            if size == 0:
+                with open(fixtures[fixture][0]) as f:
+                    size = sum(1 for line in f)
+            print >> sys.stderr, 'calc and make: {} {}'.format(fixture, size)
+            results += run_apart('calc', fixture, size, args.block)
+    for size in args.sizes.split(','):
+        print >> sys.stderr, 'diff, apply, table and join: {}'.format(size)
+        results += run_apart('partitions', 'tennis', int(size), None)
+
+    output = OrderedDict([('mergic', mergic.__version__),
+                          ('python', platform.python_version()),
+                          ('platform', platform.platform()),
+                          ('block', args.block),
+                          ('checks', checks),
+                          ('results', results)])
+    with open(args.output, 'w') as f:
+        f.write(mergic.pretty_json(output) + '\n')
+    if args.compare is not None:
+        compare(results, json.load(args.compare))
+    if not all(checks.values()):
+        sys.exit('results differ from the committed tennis files')
+
+
+if __name__ == '__main__':
+    main()
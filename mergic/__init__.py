@@ -1,3 +1,7 @@
 from .mergic import __version__
 from .mergic import Blender
 from .mergic import script
+from .mergic import Stats
+from .mergic import RecordDistance
+from .mergic import field_blocker
+from .mergic import make_server
@@ -1,13 +1,25 @@
 #!/usr/bin/env python
 
-import argparse
+# Modules that only some commands need (argparse, cPickle, difflib,
+# hashlib, multiprocessing, shutil, tempfile and the HTTP server) are
+# imported where they are used, so that light commands like check and
+# table start quickly.
+import os
 import sys
 import json
 import csv
-import pickle
-from difflib import SequenceMatcher
+import mmap
+import struct
+import math
+import time
+import types
+import itertools
+from array import array
+from cStringIO import StringIO
 from itertools import combinations
-from collections import Counter
+from bisect import bisect
+from bisect import bisect_left
+from collections import deque
 from collections import OrderedDict
 
 __version__ = '0.0.7'
@@ -25,157 +37,3309 @@ def pretty_json(thing):
                       separators=(',', ': ')).encode('utf-8')
 
 
+def read_groups(f, size=65536, data=''):
+    """Read the groups of a JSON partition from a file, one at a time.
+
+    Parameters
+    ----------
+    f : file
+        A file containing a JSON object, like a partition.
+    size : int (default=65536)
+        The number of bytes to read at a time.
+    data : str (default='')
+        Bytes already read from the start of the file.
+
+    Yields
+    ------
+    tuple
+        Each key and value of the object, in the order they appear.
+        Only one group at a time is held in memory, rather than the
+        whole file.
+
+    Raises
+    ------
+    ValueError
+        If the file isn't a JSON object.
+
+    """
+    decoder = json.JSONDecoder()
+    state = {'buffer': data, 'position': 0, 'done': False}
+
+    def more():
+        if state['done']:
+            return False
+        state['buffer'] = state['buffer'][state['position']:]
+        state['position'] = 0
+        data = f.read(max(size, len(state['buffer'])))
+        state['done'] = not data
+        state['buffer'] += data
+        return not state['done']
+
+    def skip():
+        while True:
+            buffer, position = state['buffer'], state['position']
+            while position < len(buffer) and buffer[position] in ' \t\r\n':
+                position += 1
+            state['position'] = position
+            if position < len(buffer) or not more():
+                return buffer[position:position+1]
+
+    def expect(characters):
+        found = skip()
+        if not found or found not in characters:
+            raise ValueError('Expected {} at {!r}'.format(
+                ' or '.join(characters), found or 'end of file'))
+        state['position'] += 1
+        return found
+
+    def decode():
+        skip()
+        while True:
+            try:
+                value, end = decoder.raw_decode(state['buffer'],
+                                                state['position'])
+                if end < len(state['buffer']) or state['done']:
+                    state['position'] = end
+                    return value
+            except ValueError:
+                if state['done']:
+                    raise
+            more()
+
+    expect('{')
+    if skip() == '}':
+        state['position'] += 1
+    else:
+        while True:
+            key = decode()
+            expect(':')
+            yield key, decode()
+            if expect(',}') == '}':
+                break
+    if skip():
+        raise ValueError('Extra data after partition')
+
+
+def write_groups(groups, f):
+    """Write groups to a file as a JSON partition, one at a time.
+
+    The output is the same as printing `pretty_json` of the whole
+    partition, without ever holding all of it in memory.
+
+    Parameters
+    ----------
+    groups : iterable
+        Pairs of keys and lists of values.
+    f : file
+        A file to write to.
+
+    """
+    first = True
+    for key, values in groups:
+        f.write('{\n' if first else ',\n')
+        f.write(pretty_json(OrderedDict([(key, values)]))[2:-2])
+        first = False
+    f.write('{}\n' if first else '\n}\n')
+
+
+binary_magic = 'MERGICP1'
+
+
+def encode_strings(strings):
+    """Pack strings into an array of offsets and a blob of UTF-8."""
+    encoded = []
+    for string in strings:
+        if isinstance(string, unicode):
+            string = string.encode('utf-8')
+        elif not isinstance(string, str):
+            raise ValueError('Binary partitions only hold strings, '
+                             'not {!r}'.format(string))
+        encoded.append(string)
+    offsets = array('I', [0])
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+    return offsets, ''.join(encoded)
+
+
+def little_endian(numbers):
+    """Return the bytes of an array of numbers, in little-endian order."""
+    if sys.byteorder == 'big':
+        numbers = array(numbers.typecode, numbers)
+        numbers.byteswap()
+    return numbers.tostring()
+
+
+def write_binary(groups, f):
+    """Write groups to a file as a binary partition.
+
+    The binary format is the magic bytes 'MERGICP1'; the number of groups
+    and the number of items, as little-endian unsigned 32-bit integers;
+    a string table of the group keys; a string table of the items; and
+    the index of each item's group as signed 32-bit integers. A string
+    table is the offset of each string and the end of the last string,
+    as unsigned 32-bit integers, followed by all the strings encoded as
+    UTF-8. Items are written group by group, in the order of `groups`.
+
+    Parameters
+    ----------
+    groups : iterable
+        Pairs of keys and lists of values, which must all be strings.
+    f : file
+        A file to write to.
+
+    """
+    keys = []
+    items = []
+    group_ids = array('i')
+    for key, values in groups:
+        group_ids.extend([len(keys)] * len(values))
+        keys.append(key)
+        items.extend(values)
+    f.write(binary_magic)
+    f.write(struct.pack('<II', len(keys), len(items)))
+    for strings in keys, items:
+        offsets, blob = encode_strings(strings)
+        f.write(little_endian(offsets))
+        f.write(blob)
+    f.write(little_endian(group_ids))
+
+
+def read_binary(data, decode=True):
+    """Read groups from the bytes of a binary partition.
+
+    Parameters
+    ----------
+    data : str or mmap
+        The contents of a binary partition, as written by
+        `write_binary`. A memory map of the file works, so that only
+        the parts that are used are read from disk.
+    decode : bool (default=True)
+        Whether to decode strings to unicode. Without decoding, they
+        are UTF-8 byte strings, which is faster when they are only
+        going to be written out again.
+
+    Yields
+    ------
+    tuple
+        Each key and list of values, in the order they were written.
+
+    """
+    if data[:len(binary_magic)] != binary_magic:
+        raise ValueError('Not a binary partition')
+    position = len(binary_magic)
+    counts = struct.unpack_from('<II', data, position)
+    position += 8
+    tables = []
+    for count in counts:
+        offsets = array('I')
+        offsets.fromstring(data[position:position + 4 * (count + 1)])
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        position += 4 * (count + 1)
+        blob = data[position:position + offsets[-1]]
+        position += offsets[-1]
+        strings = [blob[offsets[i]:offsets[i+1]] for i in xrange(count)]
+        if decode:
+            strings = [string.decode('utf-8') for string in strings]
+        tables.append(strings)
+    keys, items = tables
+    group_ids = array('i')
+    group_ids.fromstring(data[position:position + 4 * len(items)])
+    if sys.byteorder == 'big':
+        group_ids.byteswap()
+    groups = [[] for key in keys]
+    for item, group_id in zip(items, group_ids):
+        groups[group_id].append(item)
+    for key, values in zip(keys, groups):
+        yield key, values
+
+
+def read_partition(f, decode=True):
+    """Read the groups of a JSON or binary partition from a file.
+
+    Binary partitions are recognized by their magic bytes and are
+    memory mapped when the file allows it. JSON partitions are read
+    one group at a time by `read_groups`. With `decode` false, strings
+    from binary partitions are left as UTF-8 (see `read_binary`).
+
+    """
+    head = f.read(len(binary_magic))
+    if head != binary_magic:
+        return read_groups(f, data=head)
+    try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError):
+        data = head + f.read()
+    return read_binary(data, decode)
+
+
+def write_partition(groups, f, binary=False):
+    """Write groups to a file as a JSON or binary partition."""
+    if binary:
+        write_binary(groups, f)
+    else:
+        write_groups(groups, f)
+
+
+def pack_(args):
+    """Convert a partition to the binary format at the command line."""
+    write_binary(read_partition(args.partition), sys.stdout)
+
+
+def unpack_(args):
+    """Convert a partition to JSON at the command line."""
+    write_groups(read_partition(args.partition), sys.stdout)
+
+
+def checked(groups):
+    """Check that groups form a partition, as they go by.
+
+    Parameters
+    ----------
+    groups : iterable
+        Pairs of keys and lists of values, as from `read_groups`.
+
+    Yields
+    ------
+    tuple
+        The groups, unchanged.
+
+    Raises
+    ------
+    ValueError
+        If a value appears more than once in one value list,
+        a value appears in more than one value list,
+        or a key appears more than once.
+
+    """
+    keys = set()
+    all_items = set()
+    for key, values in groups:
+        if key in keys:
+            raise ValueError('Key {} used more than once'.format(key))
+        keys.add(key)
+        value_set = set(values)
+        if len(values) != len(value_set):
+            raise ValueError('Duplication in {}'.format(values))
+        already_seen = list(all_items & value_set)
+        if len(already_seen) != 0:
+            raise ValueError('{} in more than one group'.format(already_seen))
+        all_items.update(values)
+        yield key, values
+
+
 def check(partition):
     """Confirm the passed dict is a partition.
 
     Parameters
     ----------
-    partition : dict
-        A partition dictionary where the values are lists. Items appear
-        exactly once through all the value lists (they are "assigned to"
-        their key value.)
+    partition : dict
+        A partition dictionary where the values are lists. Items appear
+        exactly once through all the value lists (they are "assigned to"
+        their key value.)
+
+    Returns
+    -------
+    int
+        The number of items partitioned by the partition.
+
+    Raises
+    ------
+    ValueError
+        If a value appears more than once in one value list
+        or a value appears in more than one value list.
+
+    """
+    return sum(len(values) for _, values in checked(partition.items()))
+
+
+def count_groups(f):
+    """Check a partition in a file, returning its numbers of items and groups.
+
+    Raises
+    ------
+    ValueError
+        If the groups don't form a partition.
+
+    """
+    n = 0
+    groups = 0
+    for _, values in checked(read_partition(f)):
+        n += len(values)
+        groups += 1
+    return n, groups
+
+
+def read_manifest(f):
+    """Read the paths listed in a manifest file, one per line.
+
+    Blank lines and lines starting with # are skipped, and relative
+    paths are relative to the directory of the manifest.
+
+    """
+    directory = os.path.dirname(getattr(f, 'name', ''))
+    if directory.startswith('<'):
+        directory = ''
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield os.path.join(directory, line)
+
+
+def check_(args):
+    """Check partitions loaded from files at the command line.
+
+    One partition prints its numbers of items and groups, or fails with
+    its error. Several partitions, or any from a manifest, are all
+    checked in turn, with a line for each, and the command exits with
+    an error at the end if any of them couldn't be read or wasn't a
+    partition.
+
+    """
+    paths = list(args.partitions)
+    if args.manifest is not None:
+        paths.extend(read_manifest(args.manifest))
+    if not paths:
+        print "{} items in {} groups".format(*count_groups(sys.stdin))
+        return
+    if len(paths) == 1 and args.manifest is None:
+        try:
+            f = open(paths[0], 'rb')
+        except IOError as e:
+            sys.exit(str(e))
+        with f:
+            print "{} items in {} groups".format(*count_groups(f))
+        return
+    failed = 0
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                result = "{} items in {} groups".format(*count_groups(f))
+        except (IOError, ValueError) as e:
+            result = 'error: {}'.format(e)
+            failed += 1
+        print "{}: {}".format(path, result)
+    if failed:
+        sys.exit('{} of {} partitions failed'.format(failed, len(paths)))
+
+
+class Grouping(object):
+    """Disjoint groups of items, merged with union-find.
+
+    Groups are trees of items with path compression and union by size,
+    so merging and finding groups takes nearly constant time. Each
+    group also keeps its members in a linked list, so that merging a
+    group with another puts the other group's members after its own,
+    just as concatenating tuples in `link_items` does.
+
+    Attributes
+    ----------
+    parent : dict
+        Each item points to its parent in its group's tree. The root of
+        each tree points to itself.
+
+    size : dict
+        The number of members in each group, keyed by root.
+
+    max_size : int
+        The number of members in the largest group.
+
+    num_pairs : int
+        The number of pairs of items that are in the same group.
+
+    """
+
+    def __init__(self, items):
+        """Start a grouping with every item in a group by itself.
+
+        Parameters
+        ----------
+        items : iterable
+            Items to group. Repeated items are grouped only once.
+
+        """
+        self.parent = {}
+        self.size = {}
+        self.head = {}
+        self.tail = {}
+        self.next = {}
+        for item in items:
+            if item not in self.parent:
+                self.parent[item] = item
+                self.size[item] = 1
+                self.head[item] = item
+                self.tail[item] = item
+        self.max_size = 1 if self.parent else 0
+        self.num_pairs = 0
+
+    def __len__(self):
+        """Return the number of groups."""
+        return len(self.size)
+
+    def find(self, item):
+        """Return the root of the group an item is in."""
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, one, other):
+        """Merge the groups of two items.
+
+        Returns
+        -------
+        boolean
+            True if the groups were merged, False if the items were
+            already in the same group.
+
+        """
+        one = self.find(one)
+        other = self.find(other)
+        if one == other:
+            return False
+        head, tail = self.head.pop(one), self.tail.pop(other)
+        self.next[self.tail.pop(one)] = self.head.pop(other)
+        if self.size[one] < self.size[other]:
+            one, other = other, one
+        self.parent[other] = one
+        self.num_pairs += self.size[one] * self.size[other]
+        self.size[one] += self.size.pop(other)
+        self.max_size = max(self.max_size, self.size[one])
+        self.head[one] = head
+        self.tail[one] = tail
+        return True
+
+    def members(self, item):
+        """Return a tuple of the members of an item's group, in order."""
+        root = self.find(item)
+        item = self.head[root]
+        members = [item]
+        while item != self.tail[root]:
+            item = self.next[item]
+            members.append(item)
+        return tuple(members)
+
+    def groups(self):
+        """Return a list of tuples, one for each group's members."""
+        return [self.members(root) for root in self.size]
+
+
+def link_items(group_of, links):
+    """Put items that are linked into the same group.
+
+    Parameters
+    ----------
+    group_of : dict or Grouping
+        Keys are items being partitioned and values are tuples representing
+        the group that the key is currently assigned to. Usually starts as
+        every item pointing to a tuple containing only the item itself.
+        A `Grouping` can be passed instead, which merges groups without
+        building new tuples.
+    links : list
+        Contains tuples (pairs) representing items to link.
+
+    """
+    if isinstance(group_of, Grouping):
+        for one, other in links:
+            group_of.union(one, other)
+        return
+    for one, other in links:
+        if group_of[one] is group_of[other]:
+            continue
+        else:
+            union = group_of[one] + group_of[other]
+            for thing in union:
+                group_of[thing] = union
+
+
+class Distance(object):
+    """A distance between items that can be calculated a row at a time.
+
+    Subclasses implement `__call__`, `row`, or both, when a row of
+    distances can be calculated faster than one pair at a time.
+
+    Attributes
+    ----------
+    symmetric : boolean
+        True if the distance from one item to another is always the
+        same as the distance back.
+
+    metric : boolean
+        True if the distance is also never negative, zero between equal
+        items and obeys the triangle inequality, so that a `BKTree` can
+        search it.
+
+    depends_on_items : boolean
+        True if the distance between two items depends on the other
+        items the distance is fit to, so that distances found before
+        more items were added can be out of date.
+
+    """
+
+    symmetric = False
+    metric = False
+    depends_on_items = False
+
+    def __call__(self, one, other):
+        """Return the distance from one item to another."""
+        return self.row(other, [one])[0]
+
+    def row(self, item, others):
+        """Calculate the distances from each of `others` to `item`.
+
+        Returns
+        -------
+        list
+            The same as `[self(other, item) for other in others]`.
+
+        """
+        return [self(other, item) for other in others]
+
+    def bounded_row(self, item, others, max_distance):
+        """Calculate the distances from each of `others` to `item`, up to
+        `max_distance`.
+
+        Returns
+        -------
+        list
+            The same as `row`, but with None for each distance greater
+            than `max_distance`. Subclasses skip or abandon pairs that
+            can't be close enough, when they can tell cheaply.
+
+        """
+        return [distance if distance <= max_distance else None
+                for distance in self.row(item, others)]
+
+    def fit(self, items):
+        """Prepare to calculate distances between unique `items`."""
+        pass
+
+    def describe(self):
+        """Describe the distance for use in a cache key.
+
+        By default a distance is described by its class and attributes
+        (see `describe`), so subclasses that keep state from `fit`
+        should describe just their parameters.
+
+        """
+        return '({} {})'.format(describe(type(self)), describe(vars(self)))
+
+
+class FunctionDistance(Distance):
+    """A distance calculated by a function of two items."""
+
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, one, other):
+        return self.function(one, other)
+
+    def describe(self):
+        return describe(self.function)
+
+
+class StockDistance(Distance):
+    """One minus the ratio of Python's SequenceMatcher.
+
+    Rows reuse one SequenceMatcher whose second sequence stays fixed,
+    so the index of the second sequence is only built once per row.
+    Bounded rows first check the upper bounds on the ratio from the
+    items' lengths and from their character counts, which are much
+    cheaper than the ratio itself.
+
+    """
+
+    def __call__(self, one, other):
+        from difflib import SequenceMatcher
+        return 1 - SequenceMatcher(None, one, other).ratio()
+
+    def row(self, item, others):
+        from difflib import SequenceMatcher
+        matcher = SequenceMatcher(None)
+        matcher.set_seq2(item)
+        result = []
+        for other in others:
+            matcher.set_seq1(other)
+            result.append(1 - matcher.ratio())
+        return result
+
+    def bounded_row(self, item, others, max_distance):
+        from difflib import SequenceMatcher
+        matcher = SequenceMatcher(None)
+        matcher.set_seq2(item)
+        result = []
+        for other in others:
+            matcher.set_seq1(other)
+            if (1 - matcher.real_quick_ratio() > max_distance or
+                    1 - matcher.quick_ratio() > max_distance):
+                result.append(None)
+                continue
+            distance = 1 - matcher.ratio()
+            result.append(distance if distance <= max_distance else None)
+        return result
+
+
+class LevenshteinDistance(Distance):
+    """The number of insertions, deletions and substitutions between items.
+
+    Rows use Myers' bit-parallel algorithm: the positions of each
+    character of the row's item are encoded as bits once, and then each
+    other item takes a few integer operations per character. Bounded
+    rows skip items whose lengths differ by more than the bound, and
+    abandon an item as soon as the remaining characters can't bring
+    the distance back down to the bound.
+
+    """
+
+    symmetric = True
+    metric = True
+
+    def row(self, item, others):
+        length = len(item)
+        if length == 0:
+            return [len(other) for other in others]
+        peq = {}
+        for i, character in enumerate(item):
+            peq[character] = peq.get(character, 0) | (1 << i)
+        mask = (1 << length) - 1
+        top = 1 << (length - 1)
+        result = []
+        for other in others:
+            pv, mv, score = mask, 0, length
+            for character in other:
+                eq = peq.get(character, 0)
+                xv = eq | mv
+                xh = (((eq & pv) + pv) ^ pv) | eq
+                ph = mv | ~(xh | pv)
+                mh = pv & xh
+                if ph & top:
+                    score += 1
+                elif mh & top:
+                    score -= 1
+                ph = (ph << 1) | 1
+                mh = mh << 1
+                pv = (mh | ~(xv | ph)) & mask
+                mv = ph & xv
+            result.append(score)
+        return result
+
+    def bounded_row(self, item, others, max_distance):
+        length = len(item)
+        if length == 0:
+            return [len(other) if len(other) <= max_distance else None
+                    for other in others]
+        peq = {}
+        for i, character in enumerate(item):
+            peq[character] = peq.get(character, 0) | (1 << i)
+        mask = (1 << length) - 1
+        top = 1 << (length - 1)
+        result = []
+        for other in others:
+            if abs(len(other) - length) > max_distance:
+                result.append(None)
+                continue
+            pv, mv, score = mask, 0, length
+            # the distance can only fall by one per remaining character
+            slack = max_distance + len(other)
+            for character in other:
+                eq = peq.get(character, 0)
+                xv = eq | mv
+                xh = (((eq & pv) + pv) ^ pv) | eq
+                ph = mv | ~(xh | pv)
+                mh = pv & xh
+                if ph & top:
+                    score += 1
+                elif mh & top:
+                    score -= 1
+                slack -= 1
+                if score > slack:
+                    break
+                ph = (ph << 1) | 1
+                mh = mh << 1
+                pv = (mh | ~(xv | ph)) & mask
+                mv = ph & xv
+            result.append(score if score <= slack else None)
+        return result
+
+
+class JaroWinklerDistance(Distance):
+    """One minus the Jaro-Winkler similarity of items.
+
+    Rows find the positions of each character of the row's item once,
+    so that matching each other item's characters only looks at the
+    positions of the same character within the matching window, rather
+    than at every position in the window.
+
+    """
+
+    symmetric = True
+
+    def __init__(self, scaling=0.1):
+        self.scaling = scaling
+
+    def row(self, item, others):
+        positions = {}
+        for j, character in enumerate(item):
+            positions.setdefault(character, []).append(j)
+        result = []
+        for one in others:
+            if one == item:
+                result.append(0.0)
+                continue
+            if not one or not item:
+                result.append(1.0)
+                continue
+            window = max(max(len(one), len(item)) // 2 - 1, 0)
+            taken = [False] * len(item)
+            one_matches = []
+            for i, character in enumerate(one):
+                found = positions.get(character)
+                if found is None:
+                    continue
+                # the first untaken position of the character in the
+                # window, as scanning the window in order would find
+                for k in xrange(bisect_left(found, i - window), len(found)):
+                    j = found[k]
+                    if j > i + window:
+                        break
+                    if not taken[j]:
+                        taken[j] = True
+                        one_matches.append(character)
+                        break
+            matches = float(len(one_matches))
+            if not matches:
+                result.append(1.0)
+                continue
+            item_matches = [c for c, t in zip(item, taken) if t]
+            transpositions = sum(a != b for a, b in
+                                 zip(one_matches, item_matches)) / 2.0
+            jaro = (matches / len(one) + matches / len(item) +
+                    (matches - transpositions) / matches) / 3
+            prefix = 0
+            for a, b in zip(one[:4], item[:4]):
+                if a != b:
+                    break
+                prefix += 1
+            result.append(1 - (jaro + prefix * self.scaling * (1 - jaro)))
+        return result
+
+    def describe(self):
+        return '({} {!r})'.format(describe(type(self)), self.scaling)
+
+
+class NgramJaccardDistance(Distance):
+    """One minus the Jaccard similarity of items' character n-grams.
+
+    The n-grams of fitted items are found once and reused for every
+    row they appear in.
+
+    """
+
+    symmetric = True
+    metric = True
+
+    def __init__(self, n=3):
+        self.n = n
+        self.grams = {}
+
+    def fit(self, items):
+        self.grams = {item: grams(item, self.n) for item in items}
+
+    def grams_of(self, item):
+        found = self.grams.get(item)
+        if found is None:
+            found = grams(item, self.n)
+        return found
+
+    def row(self, item, others):
+        mine = self.grams_of(item)
+        result = []
+        for other in others:
+            theirs = self.grams_of(other)
+            shared = len(mine & theirs)
+            result.append(1 - shared / float(len(mine) + len(theirs) -
+                                             shared))
+        return result
+
+    def describe(self):
+        return '({} {!r})'.format(describe(type(self)), self.n)
+
+
+class TfidfCosineDistance(Distance):
+    """One minus the cosine similarity of items' tf-idf n-gram vectors.
+
+    Character n-grams are weighted by how rare they are among the
+    fitted items, so that common n-grams count for less. Vectors are
+    found once for fitted items and reused for every row.
+
+    """
+
+    symmetric = True
+    depends_on_items = True
+
+    def __init__(self, n=3):
+        self.n = n
+        self.idf = {}
+        self.default_idf = 1.0
+        self.vectors = {}
+
+    def fit(self, items):
+        frequency = {}
+        for item in items:
+            for gram in grams(item, self.n):
+                frequency[gram] = frequency.get(gram, 0) + 1
+        self.default_idf = math.log(1.0 + len(items)) + 1
+        self.idf = {gram: math.log((1.0 + len(items)) / (1 + count)) + 1
+                    for gram, count in frequency.items()}
+        self.vectors = {}
+        self.vectors = {item: self.vector_of(item) for item in items}
+
+    def vector_of(self, item):
+        found = self.vectors.get(item)
+        if found is not None:
+            return found
+        padded = ' ' + item + ' '
+        counts = {}
+        for i in range(max(len(padded) - self.n + 1, 1)):
+            gram = padded[i:i+self.n]
+            counts[gram] = counts.get(gram, 0) + 1
+        vector = {gram: count * self.idf.get(gram, self.default_idf)
+                  for gram, count in counts.items()}
+        norm = math.sqrt(sum(x * x for x in vector.values()))
+        return {gram: x / norm for gram, x in vector.items()}
+
+    def row(self, item, others):
+        mine = self.vector_of(item)
+        result = []
+        for other in others:
+            theirs = self.vector_of(other)
+            if len(theirs) < len(mine):
+                small, large = theirs, mine
+            else:
+                small, large = mine, theirs
+            dot = sum(x * large.get(gram, 0) for gram, x in small.items())
+            result.append(max(0.0, 1 - dot))
+        return result
+
+    def describe(self):
+        return '({} {!r})'.format(describe(type(self)), self.n)
+
+
+class PreprocessedDistance(Distance):
+    """A distance between preprocessed forms of items.
+
+    Each item is preprocessed once, when the distance is fit or the
+    first time the item is seen. Within a row, items with the same
+    form are only compared once. With `memo`, distances between forms
+    are also remembered across rows, so items whose forms are the same
+    are never compared again.
+
+    """
+
+    def __init__(self, distance, preprocess, memo=False):
+        self.distance = distance
+        self.preprocess = preprocess
+        self.memo = {} if memo else None
+        self.forms = {}
+        self.symmetric = distance.symmetric
+        self.metric = distance.metric
+        self.depends_on_items = distance.depends_on_items
+
+    def form_of(self, item):
+        form = self.forms.get(item)
+        if form is None:
+            form = self.forms[item] = self.preprocess(item)
+        return form
+
+    def fit(self, items):
+        self.forms = {item: self.preprocess(item) for item in items}
+        self.distance.fit(list(OrderedDict.fromkeys(self.forms[item]
+                                                    for item in items)))
+        if self.memo is not None:
+            self.memo = {}
+
+    def __call__(self, one, other):
+        return self.row(other, [one])[0]
+
+    def row(self, item, others):
+        return self.forms_row(item, others, self.distance.row)
+
+    def bounded_row(self, item, others, max_distance):
+        row = self.forms_row(
+            item, others,
+            lambda form, forms: self.distance.bounded_row(form, forms,
+                                                          max_distance))
+        return [distance if distance is not None and
+                distance <= max_distance else None
+                for distance in row]
+
+    def forms_row(self, item, others, row):
+        """Calculate a row between forms with `row`, once per form."""
+        form = self.form_of(item)
+        forms = [self.form_of(other) for other in others]
+        found = {}
+        if self.memo is not None:
+            for other in forms:
+                if (other, form) in self.memo:
+                    found[other] = self.memo[(other, form)]
+        missing = [other for other in OrderedDict.fromkeys(forms)
+                   if other not in found]
+        found.update(zip(missing, row(form, missing)))
+        if self.memo is not None:
+            for other in missing:
+                if found[other] is not None:
+                    self.memo[(other, form)] = found[other]
+        return [found[other] for other in forms]
+
+    def describe(self):
+        return '({} {})'.format(describe(self.distance),
+                                describe(self.preprocess))
+
+
+class ExactDistance(Distance):
+    """Zero between equal items and one between any others."""
+
+    symmetric = True
+    metric = True
+
+    def row(self, item, others):
+        return [0 if other == item else 1 for other in others]
+
+
+builtin_distances = {'stock': StockDistance,
+                     'levenshtein': LevenshteinDistance,
+                     'jaro_winkler': JaroWinklerDistance,
+                     'ngram_jaccard': NgramJaccardDistance,
+                     'tfidf_cosine': TfidfCosineDistance,
+                     'exact': ExactDistance}
+
+
+def fields_of(item):
+    """Split an item that is a line of CSV into its fields."""
+    if isinstance(item, unicode):
+        return [value.decode('utf-8')
+                for value in next(csv.reader([item.encode('utf-8')]))]
+    return next(csv.reader([item]))
+
+
+def field_spec(text):
+    """Parse COLUMN[:DISTANCE[:WEIGHT]] from the command line.
+
+    Columns count from one, like `cut`, and are returned counting from
+    zero. A missing distance is returned as None.
+
+    """
+    import argparse
+    parts = text.split(':')
+    try:
+        if len(parts) > 3:
+            raise ValueError
+        column = int(parts[0]) - 1
+        distance = parts[1] if len(parts) > 1 and parts[1] else None
+        weight = float(parts[2]) if len(parts) > 2 else 1
+        if column < 0 or weight < 0:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected COLUMN[:DISTANCE[:WEIGHT]], got {!r}'.format(text))
+    if distance is not None and distance not in builtin_distances:
+        raise argparse.ArgumentTypeError(
+            'unknown distance {!r}; choose from {}'.format(
+                distance, ', '.join(sorted(builtin_distances))))
+    return column, distance, weight
+
+
+def column_spec(text):
+    """Parse a column number from the command line, counting from one."""
+    import argparse
+    try:
+        column = int(text) - 1
+        if column < 0:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected a column number, got {!r}'.format(text))
+    return column
+
+
+def positive_number(text):
+    """Parse a number greater than zero from the command line."""
+    import argparse
+    try:
+        number = float(text)
+        if not number > 0:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected a positive number, got {!r}'.format(text))
+    return number
+
+
+def whole_number(text):
+    """Parse a whole number of at least zero from the command line."""
+    import argparse
+    try:
+        number = int(text)
+        if number < 0:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected a count, got {!r}'.format(text))
+    return number
+
+
+def cutoff_list(text):
+    """Parse comma-separated cutoffs from the command line.
+
+    Returns
+    -------
+    list
+        Tuples of each cutoff and the text it was given as, which names
+        the file its partition is written to.
+
+    """
+    import argparse
+    cutoffs = []
+    for name in text.split(','):
+        try:
+            cutoff = float(name)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                'expected a cutoff, got {!r}'.format(name))
+        for other, other_name in cutoffs:
+            if other == cutoff:
+                raise argparse.ArgumentTypeError(
+                    '{!r} and {!r} are the same cutoff'.format(other_name,
+                                                               name))
+        cutoffs.append((cutoff, name))
+    return cutoffs
+
+
+class RecordDistance(Distance):
+    """A weighted sum of distances between fields of CSV records.
+
+    Items are lines of CSV, which stay whole as items, so partitions
+    and merge tables show the original lines. Each item is split into
+    fields once, and each field used is kept as a column of values.
+    Rows are calculated a field at a time, as a row of that field's
+    distance over the column, and each distinct value in the column is
+    only compared once per row. Bounded rows stop comparing a record's
+    fields once its sum is past the bound.
+
+    """
+
+    def __init__(self, fields):
+        """Make a distance between records from distances between fields.
+
+        Parameters
+        ----------
+        fields : list
+            Tuples of a column number (counting from zero), a distance
+            for that field (a function, `Distance` or the name of a
+            built-in distance) and a weight.
+
+        """
+        self.fields = []
+        for column, distance, weight in fields:
+            if isinstance(distance, basestring):
+                distance = builtin_distances[distance]()
+            elif not isinstance(distance, Distance):
+                distance = FunctionDistance(distance)
+            self.fields.append((column, distance, weight))
+        self.symmetric = all(distance.symmetric
+                             for _, distance, _ in self.fields)
+        self.metric = all(distance.metric and weight > 0
+                          for _, distance, weight in self.fields)
+        self.depends_on_items = any(distance.depends_on_items
+                                    for _, distance, _ in self.fields)
+        self.index = {}
+        self.columns = [[] for _ in self.fields]
+
+    def add(self, item):
+        """Split an item into fields and add them to the columns."""
+        values = fields_of(item)
+        self.index[item] = len(self.index)
+        for (column, _, _), values_ in zip(self.fields, self.columns):
+            values_.append(values[column] if column < len(values) else '')
+
+    def fit(self, items):
+        self.index = {}
+        self.columns = [[] for _ in self.fields]
+        for item in items:
+            self.add(item)
+        for (_, distance, _), values in zip(self.fields, self.columns):
+            distance.fit(list(OrderedDict.fromkeys(values)))
+
+    def ids(self, items):
+        """Return the places of items in the columns, adding new ones."""
+        for item in items:
+            if item not in self.index:
+                self.add(item)
+        return [self.index[item] for item in items]
+
+    def row(self, item, others):
+        return self.bounded_row(item, others, None)
+
+    def bounded_row(self, item, others, max_distance):
+        i = self.ids([item])[0]
+        ids = self.ids(others)
+        totals = [0] * len(ids)
+        alive = range(len(ids))
+        for (_, distance, weight), values in zip(self.fields, self.columns):
+            column = [values[ids[k]] for k in alive]
+            unique = list(OrderedDict.fromkeys(column))
+            found = dict(zip(unique, distance.row(values[i], unique)))
+            for k, value in zip(alive, column):
+                totals[k] += weight * found[value]
+            if max_distance is not None:
+                alive = [k for k in alive if totals[k] <= max_distance]
+        if max_distance is None:
+            return totals
+        result = [None] * len(ids)
+        for k in alive:
+            result[k] = totals[k]
+        return result
+
+    def describe(self):
+        return '(RecordDistance {})'.format(' '.join(
+            '({} {} {!r})'.format(column, describe(distance), weight)
+            for column, distance, weight in self.fields))
+
+
+def grams(item, n=3):
+    """Return the set of character n-grams of an item.
+
+    The item is padded with a space on each side so that short items
+    and the ends of items still produce n-grams.
+
+    """
+    padded = ' ' + item + ' '
+    if len(padded) <= n:
+        return set([padded])
+    return set(padded[i:i+n] for i in range(len(padded) - n + 1))
+
+
+def ngram_blocker(items, n=3):
+    """Find candidate pairs of items that share a character n-gram.
+
+    Parameters
+    ----------
+    items : list
+        Unique items to find candidate pairs for.
+    n : int (default=3)
+        Length of the character n-grams to index on.
+
+    Returns
+    -------
+    set
+        Pairs (i, j) of indices into `items`, with i < j.
+
+    """
+    index = {}
+    for i, item in enumerate(items):
+        for gram in grams(item, n):
+            index.setdefault(gram, []).append(i)
+    pairs = set()
+    for ids in index.values():
+        pairs.update(combinations(ids, 2))
+    return pairs
+
+
+def ngram_columns(items, n=3):
+    """Find the candidate pairs of `ngram_blocker` a column at a time.
+
+    Yields
+    ------
+    tuple
+        Each index j into `items` that is paired with earlier items, in
+        order, and a sorted list of the indices i < j of items that
+        share a character n-gram with it.
+
+    """
+    index = {}
+    for j, item in enumerate(items):
+        found = set()
+        for gram in grams(item, n):
+            ids = index.setdefault(gram, [])
+            found.update(ids)
+            ids.append(j)
+        if found:
+            yield j, sorted(found)
+
+
+ngram_blocker.columns = ngram_columns
+
+
+def neighborhood_blocker(items, window=10, key=None):
+    """Find candidate pairs of items that sort near one another.
+
+    Parameters
+    ----------
+    items : list
+        Unique items to find candidate pairs for.
+    window : int (default=10)
+        Items are paired with the `window - 1` items following them
+        in sorted order.
+    key : function or None (default=None)
+        A sort key for items. By default items are sorted as they are.
+
+    Returns
+    -------
+    set
+        Pairs (i, j) of indices into `items`, with i < j.
+
+    """
+    if key is None:
+        key = lambda x: x
+    ids = sorted(range(len(items)), key=lambda i: key(items[i]))
+    pairs = set()
+    for position, i in enumerate(ids):
+        for j in ids[position+1:position+window]:
+            pairs.add((min(i, j), max(i, j)))
+    return pairs
+
+
+def neighborhood_columns(items, window=10, key=None):
+    """Find the candidate pairs of `neighborhood_blocker` a column at a
+    time, as for `ngram_columns`."""
+    if key is None:
+        key = lambda x: x
+    ids = sorted(range(len(items)), key=lambda i: key(items[i]))
+    rank = [0] * len(items)
+    for position, i in enumerate(ids):
+        rank[i] = position
+    for j in xrange(len(items)):
+        r = rank[j]
+        found = sorted(i for i in ids[max(0, r - window + 1):r + window]
+                       if i < j)
+        if found:
+            yield j, found
+
+
+neighborhood_blocker.columns = neighborhood_columns
+# Whether two items are paired depends on what else sorts between them.
+neighborhood_blocker.depends_on_items = True
+
+
+def key_blocker(key):
+    """Make a blocker that pairs items with the same blocking key.
+
+    Parameters
+    ----------
+    key : function
+        A function of an item that returns its blocking key.
+
+    Returns
+    -------
+    function
+        A blocker, taking a list of unique items and returning pairs
+        (i, j) of indices into it, with i < j. Its `columns` attribute
+        finds the same pairs a column at a time, as `ngram_columns`
+        does for `ngram_blocker`.
+
+    """
+    def blocker(items):
+        index = {}
+        for i, item in enumerate(items):
+            index.setdefault(key(item), []).append(i)
+        pairs = set()
+        for ids in index.values():
+            pairs.update(combinations(ids, 2))
+        return pairs
+
+    def blocker_columns(items):
+        index = {}
+        for j, item in enumerate(items):
+            ids = index.setdefault(key(item), [])
+            if ids:
+                yield j, list(ids)
+            ids.append(j)
+    blocker.columns = blocker_columns
+    return blocker
+
+
+def field_blocker(columns):
+    """Make a blocker that pairs CSV records that agree on any of some fields.
+
+    Parameters
+    ----------
+    columns : list
+        Column numbers (counting from zero) of the fields to block on.
+        Records are paired if they have the same value, other than an
+        empty one, in any of these fields.
+
+    Returns
+    -------
+    function
+        A blocker, as from `key_blocker`.
+
+    """
+    def blocker(items):
+        records = [fields_of(item) for item in items]
+        pairs = set()
+        for column in columns:
+            index = {}
+            for i, values in enumerate(records):
+                if column < len(values) and values[column] != '':
+                    index.setdefault(values[column], []).append(i)
+            for ids in index.values():
+                pairs.update(combinations(ids, 2))
+        return pairs
+
+    def blocker_columns(items):
+        indexes = [{} for _ in columns]
+        for j, item in enumerate(items):
+            values = fields_of(item)
+            found = set()
+            for column, index in zip(columns, indexes):
+                if column < len(values) and values[column] != '':
+                    ids = index.setdefault(values[column], [])
+                    found.update(ids)
+                    ids.append(j)
+            if found:
+                yield j, sorted(found)
+    blocker.columns = blocker_columns
+    return blocker
+
+
+def candidate_positions(items, blocker=None):
+    """Generate the pairs of positions that distances are calculated for.
+
+    Parameters
+    ----------
+    items : list
+        Items to pair up. Items may appear more than once.
+    blocker : function or None (default=None)
+        A function of a list of unique items that returns pairs (i, j)
+        of indices into it, with i < j. If None, all pairs are used.
+
+    Yields
+    ------
+    tuple
+        Pairs (p, q) of positions in `items`, with p < q, in the order
+        that `itertools.combinations` would produce them. Of the pairs
+        holding the same two items in the same order only the first is
+        produced, since later ones can never link anything new. An item
+        that appears more than once is also paired with itself, once.
+
+    """
+    positions = {}
+    for position, item in enumerate(items):
+        positions.setdefault(item, []).append(position)
+    firsts = sorted(found[0] for found in positions.values())
+    for p in firsts:
+        found = positions[items[p]]
+        if len(found) > 1:
+            yield (p, found[1])
+    if blocker is None:
+        if len(firsts) == len(items):
+            for pair in combinations(range(len(items)), 2):
+                yield pair
+            return
+        for p in firsts:
+            seen = set([items[p]])
+            for q in xrange(p + 1, len(items)):
+                if items[q] not in seen:
+                    seen.add(items[q])
+                    yield (p, q)
+        return
+    unique = [items[p] for p in firsts]
+    pairs = []
+    for i, j in blocker(unique):
+        p, q = firsts[i], firsts[j]
+        pairs.append((p, q))
+        found = positions[unique[i]]
+        if found[-1] > q:
+            pairs.append((q, found[bisect(found, q)]))
+    pairs.sort()
+    for pair in pairs:
+        yield pair
+
+
+def candidate_pairs(items, blocker=None):
+    """Generate the pairs of items that distances are calculated for.
+
+    Parameters
+    ----------
+    items : list
+        Items to pair up. Items may appear more than once.
+    blocker : function or None (default=None)
+        A function of a list of unique items that returns pairs (i, j)
+        of indices into it, with i < j. If None, all pairs are used.
+
+    Yields
+    ------
+    tuple
+        Pairs of items, as placed by `candidate_positions`.
+
+    """
+    for p, q in candidate_positions(items, blocker):
+        yield (items[p], items[q])
+
+
+def candidate_columns(items, blocker=None, start=0):
+    """Group candidate pairs of positions by their second position.
+
+    Parameters
+    ----------
+    items : list
+        Items to pair up. Items may appear more than once.
+    blocker : function or None (default=None)
+        A blocker, as for `candidate_positions`.
+    start : int (default=0)
+        Only yield columns for positions q of at least `start`. When
+        lines are appended to `items`, these are exactly the pairs that
+        weren't candidates for the first `start` lines.
+
+    Yields
+    ------
+    tuple
+        A position q in `items` and a list of the positions p that are
+        paired with it by `candidate_positions`, with q increasing.
+
+    """
+    if blocker is None and len(set(items)) == len(items):
+        for q in xrange(max(start, 1), len(items)):
+            yield q, range(q)
+        return
+    if blocker is None:
+        # Each column holds the first positions of other items since
+        # the last time the item at q was seen, and the second time an
+        # item is seen it is also paired with its first, so columns are
+        # found one at a time and only from `start` on.
+        firsts = []
+        first, last = {}, {}
+        for q, item in enumerate(items):
+            previous = last.get(item)
+            if q >= start:
+                if previous is None:
+                    ps = list(firsts)
+                else:
+                    ps = firsts[bisect(firsts, previous):]
+                    if previous == first[item]:
+                        ps.insert(0, previous)
+                if ps:
+                    yield q, ps
+            if previous is None:
+                first[item] = q
+                firsts.append(q)
+            last[item] = q
+        return
+    columns = {}
+    for p, q in candidate_positions(items, blocker):
+        if q >= start:
+            columns.setdefault(q, []).append(p)
+    for q in sorted(columns):
+        yield q, columns[q]
+
+
+def streamed_columns(items, blocker, start=0):
+    """Generate candidate pairs of positions a column at a time.
+
+    Finds the same pairs as `candidate_columns`, but from a blocker's
+    `columns` attribute, which finds the pairs of unique items a column
+    at a time (see `ngram_columns`), so that the pairs are never all
+    held in memory at once.
+
+    Parameters
+    ----------
+    items : list
+        Items to pair up. Items may appear more than once.
+    blocker : function
+        A blocker with a `columns` attribute.
+    start : int (default=0)
+        Only yield pairs with a position q of at least `start`, as for
+        `candidate_columns`.
+
+    Yields
+    ------
+    tuple
+        A position q in `items` and a list of the positions p that are
+        paired with it by `candidate_positions`. Unlike with
+        `candidate_columns`, a position q may have more than one
+        column, and columns aren't in order of q.
+
+    """
+    positions = {}
+    for position, item in enumerate(items):
+        positions.setdefault(item, []).append(position)
+    firsts = sorted(found[0] for found in positions.values())
+    for p in firsts:
+        found = positions[items[p]]
+        if len(found) > 1 and found[1] >= start:
+            yield found[1], [p]
+    unique = [items[p] for p in firsts]
+    for j, ids in blocker.columns(unique):
+        q = firsts[j]
+        if q >= start:
+            yield q, [firsts[i] for i in ids]
+        for i in ids:
+            found = positions[unique[i]]
+            if found[-1] > q:
+                r = found[bisect(found, q)]
+                if r >= start:
+                    yield r, [q]
+
+
+class Stats(object):
+    """Timings and counts collected while a Blender works.
+
+    Attributes
+    ----------
+    phases : OrderedDict
+        Seconds of wall time spent in each phase of work, like reading
+        input, the cache, calculating distances, agglomerating and
+        writing output, in the order the phases first started.
+
+    counts : OrderedDict
+        Counts of things like distance calls and cache hits and misses.
+
+    latencies : dict
+        Numbers of distance calls by their time in microseconds, rounded
+        up to a power of two. Rows of distances are timed as a whole,
+        and each call in a row is counted at the row's average time.
+        Calls made by worker processes are counted but not timed.
+
+    """
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.counts = OrderedDict()
+        self.latencies = {}
+        self.current = None
+        self.started = None
+
+    def phase(self, name):
+        """End the current phase, if any, and start phase `name`.
+
+        Phases can be started more than once; their times add up. A
+        `name` of None just ends the current phase.
+
+        """
+        now = time.time()
+        if self.current is not None:
+            self.phases[self.current] += now - self.started
+        if name is not None:
+            self.phases.setdefault(name, 0.0)
+        self.current, self.started = name, now
+
+    def count(self, name, n=1):
+        """Add `n` to the count called `name`."""
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def time_calls(self, calls, seconds):
+        """Record that `calls` distance calls took `seconds` in all."""
+        if calls == 0:
+            return
+        self.count('distance_calls', calls)
+        bound = 1
+        while bound < 1e6 * seconds / calls:
+            bound *= 2
+        self.latencies[bound] = self.latencies.get(bound, 0) + calls
+
+    def report(self):
+        """Return the stats as a dictionary that can be dumped as JSON.
+
+        The current phase is included up to now, and peak memory (the
+        maximum resident set size in kilobytes, of this process or any
+        worker process) is included where the platform reports it.
+
+        """
+        phases = OrderedDict(self.phases)
+        if self.current is not None:
+            phases[self.current] += time.time() - self.started
+        latencies = OrderedDict((str(bound), self.latencies[bound])
+                                for bound in sorted(self.latencies))
+        result = OrderedDict([('phases', phases),
+                              ('counts', self.counts),
+                              ('distance_latency_us', latencies)])
+        try:
+            import resource
+        except ImportError:
+            return result
+        result['peak_rss_kb'] = max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        return result
+
+
+def phase(stats, name):
+    """Start phase `name` in `stats`, unless `stats` is None."""
+    if stats is not None:
+        stats.phase(name)
+
+
+# The distance and items used by worker processes, set in each worker
+# by `init_worker`. Where processes fork, workers inherit them without
+# pickling, which works even for distance functions that can't be
+# pickled; elsewhere they are pickled to each worker.
+worker_distance = None
+worker_items = None
+worker_bound = None
+
+
+def init_worker(distance, items, bound):
+    """Set the distance, items and bound for a worker process."""
+    global worker_distance, worker_items, worker_bound
+    worker_distance, worker_items, worker_bound = distance, items, bound
+
+
+def can_send(distance):
+    """Return True if worker processes can be given the distance."""
+    if hasattr(os, 'fork'):
+        return True
+    import cPickle
+    try:
+        cPickle.dumps(distance, cPickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return False
+    return True
+
+
+def bounded_row(distance, item, others, max_distance=None):
+    """Calculate a row of a distance, bounded unless `max_distance` is None."""
+    if max_distance is None:
+        return distance.row(item, others)
+    return distance.bounded_row(item, others, max_distance)
+
+
+def chunk_rows(columns):
+    """Calculate rows of `worker_distance` between `worker_items`."""
+    return [bounded_row(worker_distance, worker_items[q],
+                        [worker_items[p] for p in ps], worker_bound)
+            for q, ps in columns]
+
+
+def _row(self, item, others):
+    """Calculate the distances from each of `others` to `item`.
+
+    Distances are bounded by `max_distance`, if there is one, and rows
+    are timed into `stats`, if it is kept.
+
+    """
+    if self.stats is None:
+        return bounded_row(self.distance, item, others, self.max_distance)
+    start = time.time()
+    row = bounded_row(self.distance, item, others, self.max_distance)
+    self.stats.time_calls(len(others), time.time() - start)
+    return row
+
+
+def _distances(self, items, columns):
+    """Calculate distances for pairs of items, a row at a time.
+
+    Parameters
+    ----------
+    items : list
+        Items to calculate distances between.
+    columns : iterable
+        Pairs of a position q in `items` and a list of positions p to
+        calculate distances from, as made by `candidate_columns`.
+
+    Yields
+    ------
+    tuple
+        Each position q, its list of positions p, and the list of
+        distances from each item at p to the item at q, in the order
+        of `columns`. With more than one worker, chunks of rows are
+        calculated in parallel by a pool of processes, unless the
+        platform can't fork and the distance can't be pickled, when
+        they are calculated in this process. With a `max_distance`,
+        distances greater than it are None.
+
+    """
+    if (self.workers is None or self.workers < 2 or
+            not can_send(self.distance)):
+        for q, ps in columns:
+            yield q, ps, self.row(items[q], [items[p] for p in ps])
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(self.workers, init_worker,
+                                (self.distance, items, self.max_distance))
+    try:
+        sent = deque()
+
+        def send():
+            chunk, size = [], 0
+            for q, ps in columns:
+                chunk.append((q, ps))
+                size += len(ps)
+                if size >= 10000:
+                    sent.append(chunk)
+                    yield chunk
+                    chunk, size = [], 0
+            if chunk:
+                sent.append(chunk)
+                yield chunk
+
+        for rows in pool.imap(chunk_rows, send()):
+            for (q, ps), row in zip(sent.popleft(), rows):
+                if self.stats is not None:
+                    self.stats.count('distance_calls', len(ps))
+                yield q, ps, row
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _spanning_tree(self, items):
+    """Find the links of a minimum spanning tree over items.
+
+    Uses Prim's algorithm, calculating a row of distances from each
+    item as it joins the tree, so only the tree and one row of
+    distances are ever held in memory. Ties are broken the way `calc`
+    breaks them when linking all pairs, so grouping with the tree links
+    gives the same groups, in the same order, as grouping with all the
+    links.
+
+    Parameters
+    ----------
+    items : list
+        Items to link. Items may appear more than once.
+
+    Returns
+    -------
+    tuple
+        A `links_at` dict holding only the links in the tree, and the
+        set of all the distinct distances that were calculated.
+
+    """
+    positions = {}
+    for position, item in enumerate(items):
+        positions.setdefault(item, []).append(position)
+    unique = sorted(positions, key=lambda item: positions[item][0])
+    first = [positions[item][0] for item in unique]
+    last = [positions[item][-1] for item in unique]
+    distances = set()
+    for item in unique:
+        if len(positions[item]) > 1:
+            distances.add(self.distance(item, item))
+
+    def after(i, q):
+        # the first position of unique item i after position q
+        found = positions[unique[i]]
+        return found[bisect(found, q)]
+
+    def links(i, js):
+        # The best link between item i and each item j. Pairs come in
+        # the order of their first positions, and may also appear in
+        # the other order if the first item appears again later.
+        item = unique[i]
+        seconds = [j for j in js if j < i or last[i] > first[j]]
+        firsts = [j for j in js if j > i or last[j] > first[i]]
+        if self.distance.symmetric:
+            seconds = sorted(set(seconds + firsts))
+        second = dict(zip(seconds, self.row(
+            item, [unique[j] for j in seconds])))
+        if self.distance.symmetric:
+            first_ = second
+        else:
+            first_ = {j: self.row(unique[j], [item])[0] for j in firsts}
+        distances.update(second.values())
+        distances.update(first_.values())
+        best = {}
+        for j in js:
+            other = unique[j]
+            if j > i:
+                best[j] = (first_[j], first[i], first[j], item, other)
+                if last[i] > first[j]:
+                    best[j] = min(best[j], (second[j], first[j],
+                                            after(i, first[j]),
+                                            other, item))
+            else:
+                best[j] = (second[j], first[j], first[i], other, item)
+                if last[j] > first[i]:
+                    best[j] = min(best[j], (first_[j], first[i],
+                                            after(j, first[i]),
+                                            item, other))
+        return best
+
+    if not unique:
+        return {}, distances
+    tree = []
+    remaining = range(1, len(unique))
+    best = links(0, remaining)
+    while remaining:
+        k = min(range(len(remaining)), key=lambda k: best[remaining[k]])
+        i = remaining[k]
+        remaining[k] = remaining[-1]
+        remaining.pop()
+        tree.append(best.pop(i))
+        for j, candidate in links(i, remaining).items():
+            if candidate < best[j]:
+                best[j] = candidate
+    tree.sort()
+    links_at = {}
+    for distance, p, q, one, other in tree:
+        links_at.setdefault(distance, []).append((one, other))
+    return links_at, distances
+
+
+def _links(self, items, start=0):
+    """Find the links between all candidate pairs of items.
+
+    Parameters
+    ----------
+    items : list
+        Items to link. Items may appear more than once.
+    start : int (default=0)
+        Only link pairs with a position of at least `start`, as for
+        `candidate_columns`.
+
+    Returns
+    -------
+    dict
+        Lists of the pairs of positions (p, q) in `items` at each
+        distance, in no particular order. With a `max_distance`, only
+        pairs within it are linked.
+
+    """
+    links_at = {}
+    columns = candidate_columns(items, self.blocker, start)
+    for q, ps, row in self.distances(items, columns):
+        for p, distance in zip(ps, row):
+            if distance is not None:
+                links_at.setdefault(distance, []).append((p, q))
+    return links_at
+
+
+# A rough size in bytes of a link held in memory as a tuple of a
+# distance and two positions, for keeping to a memory budget.
+bytes_per_link = 160
+
+# The most sorted runs to merge at once, before merging them into one
+# bigger run, so as not to open too many files.
+max_runs = 64
+
+
+def write_run(links, f):
+    """Write links to a file in pickled blocks and rewind it."""
+    import cPickle
+    for block in batched(links, 4096):
+        cPickle.dump(block, f, cPickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+
+
+def read_run(f):
+    """Read the links from a file written by `write_run`, in order."""
+    import cPickle
+    while True:
+        try:
+            block = cPickle.load(f)
+        except EOFError:
+            return
+        for link in block:
+            yield link
+
+
+def _spilled_links(self, items, start=0, extra=()):
+    """Find the links that merge groups, spilling sorted runs to disk.
+
+    Links are gathered in memory until they would take about
+    `memory_budget` bytes, then sorted by distance and positions and
+    written to a temporary file. The sorted runs are merged back in
+    that order, the order `fit` links pairs in, and only the links that
+    merge two groups are kept, so memory doesn't grow with the number
+    of pairs and grouping with the links gives the same results as
+    grouping with all of them. Blocked pairs are found a column at a
+    time with `streamed_columns` if the blocker has a `columns`
+    attribute; otherwise the blocker's pairs are all held at once.
+
+    Parameters
+    ----------
+    items : list
+        Items to link. Items may appear more than once.
+    start : int (default=0)
+        Only link pairs with a position of at least `start`, as for
+        `candidate_columns`.
+    extra : iterable (default=())
+        More links to consider, as tuples of a distance and a pair of
+        positions (p, q).
+
+    Returns
+    -------
+    tuple
+        A `links_at` dict like that from `links`, holding only the
+        links that merge groups, and a sorted list of all the distinct
+        distances.
+
+    """
+    import heapq
+    import tempfile
+    size = max(1, self.memory_budget // bytes_per_link)
+    links = list(extra)
+    runs = []
+
+    def spill(runs):
+        links.sort()
+        f = tempfile.TemporaryFile()
+        runs.append(f)
+        write_run(links, f)
+        del links[:]
+        if self.stats is not None:
+            self.stats.count('spilled_runs')
+        if len(runs) == max_runs:
+            f = tempfile.TemporaryFile()
+            write_run(heapq.merge(*[read_run(run) for run in runs]), f)
+            for run in runs:
+                run.close()
+            runs[:] = [f]
+
+    try:
+        if len(links) >= size:
+            spill(runs)
+        if getattr(self.blocker, 'columns', None) is not None:
+            columns = streamed_columns(items, self.blocker, start)
+        else:
+            columns = candidate_columns(items, self.blocker, start)
+        for q, ps, row in self.distances(items, columns):
+            for p, distance in zip(ps, row):
+                if distance is not None:
+                    links.append((distance, p, q))
+            if len(links) >= size:
+                spill(runs)
+        links.sort()
+        phase(self.stats, 'merge runs')
+        grouping = Grouping(items)
+        links_at = {}
+        distances = []
+        for distance, p, q in heapq.merge(links, *[read_run(run)
+                                                   for run in runs]):
+            if not distances or distance != distances[-1]:
+                distances.append(distance)
+            if grouping.union(items[p], items[q]):
+                links_at.setdefault(distance, []).append((p, q))
+        return links_at, distances
+    finally:
+        for run in runs:
+            run.close()
+
+
+def order_groups(groups, items):
+    """Concatenate all the groups in a grouping into one tuple.
+
+    Parameters
+    ----------
+    groups : list
+        Tuples holding the members of each group.
+    items : list
+        Items in their original order. Groups are concatenated in the
+        order that their first members appear here.
+
+    Returns
+    -------
+    tuple
+        All the items, with the members of each group together.
+
+    """
+    if len(groups) == 1:
+        return groups[0]
+    position = {}
+    for i, item in enumerate(items):
+        position.setdefault(item, i)
+    return tuple(itertools.chain.from_iterable(
+        sorted(groups, key=lambda x: position[x[0]])))
+
+
+def index_partition(partition):
+    """Map each item in a partition to the key of its group."""
+    index = {}
+    for key, values in partition.items():
+        for value in values:
+            index[value] = key
+    return index
+
+
+def find_groups(partition, index, values, used, found):
+    """Find the groups of a partition that values are assigned to.
+
+    Parameters
+    ----------
+    partition : dict
+        A partition dictionary.
+    index : dict
+        Each item in `partition` mapped to the key of its group, as
+        made by `index_partition`.
+    values : list
+        Values to find the groups of.
+    used : set
+        Keys of groups that are already accounted for. The keys of
+        newly found groups are added.
+    found : set
+        Values from groups that are already found. The values of newly
+        found groups are added.
+
+    Raises
+    ------
+    ValueError
+        If a value is not in `found` and its group is missing or
+        already used.
+
+    """
+    not_found = set()
+    for value in values:
+        if value in found:
+            continue
+        key = index.get(value)
+        if key is None or key in used:
+            not_found.add(value)
+        else:
+            used.add(key)
+            found.update(partition[key])
+    if not_found:
+        raise ValueError(not_found)
+
+
+def diff(first, second):
+    """Generate the differences from a first to a second partition.
+
+    Parameters
+    ----------
+    first  : dict
+    second : dict
+        Partition dictionaries where the values are lists. In each,
+        items appear exactly once through all the value lists (they
+        are "assigned to" their key value.)
+
+    Returns
+    -------
+    OrderedDict
+        A "patch" partition, for the set of values that are assigned
+        differently in the second partition than the first, in the
+        order of the second. It can be applied to the first partition
+        to generate the second.
+
+    Raises
+    ------
+    ValueError
+        If a value in the first partition is not assigned anywhere in
+        the second partition or if the second partition assigns a
+        value not found in the first partition.
+
+    Neither partition is changed. Each item is looked up in an index of
+    the first partition, so the time taken grows with the number of
+    items rather than with the number of groups changed times the
+    number of groups.
+
+    """
+    index = index_partition(first)
+    used = set()
+    mixed_from = set()
+    mixed_to = set()
+    patch = OrderedDict()
+    for key, values in second.items():
+        if (key in first and key not in used and
+                set(first[key]) == set(values)):
+            used.add(key)
+        else:
+            patch[key] = values
+            mixed_to.update(values)
+            find_groups(first, index, values, used, mixed_from)
+    if mixed_from != mixed_to:
+        not_assigned = mixed_from - mixed_to
+        raise ValueError(not_assigned)
+    return patch
+
+
+def diff_(args):
+    """Check and diff two partitions loaded from files at the command line."""
+    first = OrderedDict(checked(read_partition(args.first)))
+    second = OrderedDict(checked(read_partition(args.second)))
+    patch = diff(first, second)
+    write_partition(patch.items(), sys.stdout, args.binary)
+
+
+def equal(first, second):
+    """Check a first and second partition for equality.
+
+    Parameters
+    ----------
+    first  : dict
+    second : dict
+        Partition dictionaries where the values are lists. In each,
+        items appear exactly once through all the value lists (they
+        are "assigned to" their key value.)
+
+    Returns
+    -------
+    boolean
+        True if the difference is empty, otherwise False.
+
+    """
+    try:
+        patch = diff(first, second)
+        if patch == {}:
+            return True
+    except ValueError:
+        pass
+    return False
+
+
+def apply_groups(groups, patch, allow_new=False):
+    """Apply a patch to groups of a partition, as they go by.
+
+    Parameters
+    ----------
+    groups : iterable
+        Pairs of keys and lists of values, as from `read_groups`.
+
+    patch : dict
+        A "patch" partition, for the set of values that should be
+        assigned differently from how they are in the groups.
+
+    allow_new : boolean (default=False)
+        If True, values in the patch that aren't in the groups are
+        added, as in the patches made by `Blender.assign`.
+
+    Yields
+    ------
+    tuple
+        The groups that the patch doesn't change, as they go by, and
+        then the groups of the patch.
+
+    Raises
+    ------
+    ValueError
+        If a value in the patch is not in the groups (unless
+        `allow_new`), or a value in a group changed by the patch is not
+        in the patch. This is only known once all the groups have gone
+        by.
+
+    """
+    patched = index_partition(patch)
+    unchanged = set()
+    mixed_from = set()
+    for key, values in groups:
+        if patch.get(key) == values:
+            # this shouldn't happen, but still...
+            unchanged.add(key)
+            yield key, values
+        elif key in patch or any(value in patched for value in values):
+            mixed_from.update(values)
+        else:
+            yield key, values
+    mixed_to = set()
+    for key, values in patch.items():
+        if key not in unchanged:
+            mixed_to.update(values)
+    not_found = mixed_to - mixed_from
+    if not_found and not allow_new:
+        raise ValueError(not_found)
+    not_assigned = mixed_from - mixed_to
+    if not_assigned:
+        raise ValueError(not_assigned)
+    for key, values in patch.items():
+        if key not in unchanged:
+            yield key, values
+
+
+def apply_diff(partition, patch, allow_new=False):
+    """Apply a patch to a partition (in place).
+
+    Parameters
+    ----------
+    partition : dict
+        A partition dictionary where the values are lists. Items appear
+        exactly once through all the value lists (they are "assigned to"
+        their key value.)
+
+    patch : dict
+        A "patch" partition, for the set of values that should be
+        assigned differently from how they are in the original
+        partition.
+
+    allow_new : boolean (default=False)
+        If True, values in the patch that aren't in the partition are
+        added to it.
+
+    Returns
+    -------
+    None
+        The `partition` passed is modified in place. If the patch
+        can't be applied, ValueError is raised and `partition` is left
+        as it was.
+
+    """
+    result = list(apply_groups(partition.items(), patch, allow_new))
+    partition.clear()
+    partition.update(result)
+
+
+def apply_diff_(args):
+    """Apply a patch to a partition, at the command line."""
+    groups = checked(read_partition(args.partition))
+    patch = OrderedDict(read_partition(args.patch))
+    write_partition(apply_groups(groups, patch, args.allow_new),
+                    sys.stdout, args.binary)
+
+
+def table(partition, position=None):
+    """Generate 'merge table' rows from a partition.
+
+    Parameters
+    ----------
+    partition : dict
+        A partition dictionary where the values are lists. Items appear
+        exactly once through all the value lists (they are "assigned to"
+        their key value.)
+
+    position : dict or None (default=None)
+        An index of item positions, like `Blender.position`. If given,
+        rows are sorted by the position of their original value, with
+        values that aren't in the index last.
+
+    Yields
+    ------
+    tuple
+        Pairs of original and new names, as specified in the partition.
+
+    """
+    rows = ((value, key)
+            for key, values in partition.items()
+            for value in values)
+    if position is not None:
+        end = len(position)
+        rows = sorted(rows, key=lambda row: position.get(row[0], end))
+    for row in rows:
+        yield row
+
+
+def utf8(element):
+    """Encode an element of a partition as UTF-8 for output."""
+    if isinstance(element, unicode):
+        return element.encode('utf-8')
+    return str(element)
+
+
+def write_batches(batches, f, buffer_size=65536):
+    """Write batches of CSV rows to a file through a buffer.
+
+    Each batch is formatted with one call, and the buffer is written
+    to `f` whenever it holds `buffer_size` bytes, which is much faster
+    than writing row by row.
+
+    Parameters
+    ----------
+    batches : iterable
+        Lists of rows, each a list of byte strings.
+    f : file
+        A file to write to.
+    buffer_size : int (default=65536)
+        How many bytes to buffer before writing.
+
+    """
+    buf = StringIO()
+    writer = csv.writer(buf)
+    for rows in batches:
+        writer.writerows(rows)
+        if buf.tell() >= buffer_size:
+            f.write(buf.getvalue())
+            buf.seek(0)
+            buf.truncate()
+    f.write(buf.getvalue())
+
+
+def batched(rows, size=4096):
+    """Gather rows into lists of up to `size` rows."""
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_table(groups, f):
+    """Write a merge table as CSV.
+
+    Rows come in the order of the groups, and of the values within
+    each group, so the same partition file always gives the same
+    table. Each group's rows are written as one batch.
+
+    Parameters
+    ----------
+    groups : iterable
+        Pairs of keys and lists of values, as from `read_partition`.
+    f : file
+        A file to write to.
+
+    """
+    def batches():
+        yield [['original', 'mergic']]
+        for key, values in groups:
+            key = utf8(key)
+            yield [[utf8(value), key] for value in values]
+    write_batches(batches(), f)
+
+
+def table_(args):
+    """Print out a two-column 'merge table' at the command line."""
+    write_table(checked(read_partition(args.partition, decode=False)),
+                sys.stdout)
+
+
+def join(groups, rows, column):
+    """Add the key of each row's value in a column to rows of CSV.
+
+    This is the same as making a merge table and merging it on to the
+    data, but reads the data only once and never holds it in memory.
+
+    Parameters
+    ----------
+    groups : iterable
+        Pairs of keys and lists of values, as from `read_partition`.
+    rows : iterable
+        Lists of byte strings, as from `csv.reader`, starting with a
+        header row.
+    column : str
+        The name of the column to look values up from.
+
+    Yields
+    ------
+    list
+        The header with a `mergic` column added, then each row with
+        the key of its value added. Values that aren't in the partition
+        get an empty key.
+
+    Raises
+    ------
+    ValueError
+        If there is no such column in the header.
+
+    """
+    key_of = {}
+    for key, values in groups:
+        key = utf8(key)
+        for value in values:
+            key_of[utf8(value)] = key
+    rows = iter(rows)
+    header = next(rows, [])
+    if column not in header:
+        raise ValueError('No column {!r} in {}'.format(column, header))
+    i = header.index(column)
+    yield header + ['mergic']
+    for row in rows:
+        yield row + [key_of.get(row[i], '') if i < len(row) else '']
+
+
+def join_(args):
+    """Print out data with a `mergic` key column at the command line."""
+    rows = join(checked(read_partition(args.partition, decode=False)),
+                csv.reader(args.data), args.column)
+    write_batches(batched(rows), sys.stdout)
+
+
+def report_cutoffs(cutoffs, step=None, quantiles=None):
+    """Choose which cutoffs to report in a summary.
+
+    Parameters
+    ----------
+    cutoffs : list
+        A sorted list of cutoffs.
+    step : number or None (default=None)
+        Report the largest cutoff in each interval of this width.
+    quantiles : int or None (default=None)
+        Report the cutoffs at this many evenly spaced quantiles.
+
+    Returns
+    -------
+    set
+        The indices in `cutoffs` to report. Every index is reported if
+        neither `step` nor `quantiles` is given.
+
+    Raises
+    ------
+    ValueError
+        If `step` isn't positive or `quantiles` is negative.
+
+    """
+    if step is not None and not step > 0:
+        raise ValueError('step must be positive, not {}'.format(step))
+    if quantiles is not None and quantiles < 0:
+        raise ValueError('quantiles must not be negative, not '
+                         '{}'.format(quantiles))
+    if step is None and quantiles is None:
+        return set(range(len(cutoffs)))
+    report = set()
+    if step is not None:
+        for k in range(len(cutoffs)):
+            if (k + 1 == len(cutoffs) or
+                    cutoffs[k+1] // step != cutoffs[k] // step):
+                report.add(k)
+    if quantiles is not None and cutoffs:
+        for q in range(1, quantiles + 1):
+            report.add(int(round(q * (len(cutoffs) - 1.0) / quantiles)))
+    return report
+
+
+blockers = {'ngram': ngram_blocker,
+            'neighborhood': neighborhood_blocker}
+
+
+class ScanIndex(object):
+    """A nearest neighbour index that compares every member.
+
+    Works with any distance, calculating a bounded row of distances
+    from all the members for each search.
+
+    """
+
+    def __init__(self, distance):
+        self.distance = distance
+        self.members = []
+
+    def add(self, item):
+        """Add an item to the index as its next member."""
+        self.members.append(item)
+
+    def candidates(self, item):
+        """Return the (sorted) ids of members that might be near `item`."""
+        return range(len(self.members))
+
+    def nearest(self, item, cutoff):
+        """Find the member nearest to an item.
+
+        Returns
+        -------
+        tuple or None
+            The distance from the nearest member to `item` and the
+            member's id (its place in the order members were added),
+            with ties going to the earliest member, or None if no
+            member is within `cutoff`.
+
+        """
+        ids = self.candidates(item)
+        row = self.distance.bounded_row(item, [self.members[i] for i in ids],
+                                        cutoff)
+        found = [(distance, i) for distance, i in zip(row, ids)
+                 if distance is not None]
+        return min(found) if found else None
+
+
+class NgramIndex(ScanIndex):
+    """A nearest neighbour index over members' character n-grams.
+
+    Only members that share an n-gram with an item are compared, as
+    with `ngram_blocker`, so a member within the cutoff is missed if
+    it shares no n-gram with the item.
+
+    """
+
+    def __init__(self, distance, n=3):
+        ScanIndex.__init__(self, distance)
+        self.n = n
+        self.postings = {}
+
+    def add(self, item):
+        for gram in grams(item, self.n):
+            self.postings.setdefault(gram, []).append(len(self.members))
+        self.members.append(item)
+
+    def candidates(self, item):
+        ids = set()
+        for gram in grams(item, self.n):
+            ids.update(self.postings.get(gram, []))
+        return sorted(ids)
+
+
+class BKTree(ScanIndex):
+    """A Burkhard-Keller tree, for nearest neighbours in a metric.
+
+    Each node keeps its children by their distance from it. By the
+    triangle inequality, a search only visits the children whose
+    distance from a node is within the search radius of the item's
+    distance from the node, so it finds the same nearest member as a
+    scan with far fewer distance calculations. The distance must be
+    `metric`.
+
+    """
+
+    def __init__(self, distance):
+        if not distance.metric:
+            raise ValueError('A BKTree needs a metric distance')
+        ScanIndex.__init__(self, distance)
+        self.root = None
+
+    def add(self, item):
+        node = (len(self.members), {})
+        self.members.append(item)
+        if self.root is None:
+            self.root = node
+            return
+        parent = self.root
+        while True:
+            distance = self.distance(self.members[parent[0]], item)
+            if distance not in parent[1]:
+                parent[1][distance] = node
+                return
+            parent = parent[1][distance]
+
+    def nearest(self, item, cutoff):
+        best = None
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            i, children = stack.pop()
+            distance = self.distance(self.members[i], item)
+            if distance <= cutoff and (best is None or
+                                       (distance, i) < best):
+                best = (distance, i)
+            radius = cutoff if best is None else best[0]
+            for away, child in children.items():
+                if distance - radius <= away <= distance + radius:
+                    stack.append(child)
+        return best
+
+
+indexes = {'scan': ScanIndex,
+           'ngram': NgramIndex,
+           'bktree': BKTree}
+
+
+# Flag of types defined by Python code, whose namespaces can be described.
+heap_type = 1 << 9
+
+# Ids of the objects that `describe` is in the middle of describing, to
+# stop at objects that refer back to themselves.
+describing = set()
+
+
+def describe(thing):
+    """Describe a function or other object for use in a cache key.
+
+    Functions are described by their name and their compiled code,
+    including the code and values they close over, so changing a
+    function's definition changes its description. Methods and partial
+    functions are described by their function and what is bound to it,
+    classes by their name, bases and everything they define, and other
+    objects by their class and attributes.
+
+    Raises
+    ------
+    ValueError
+        If the object can't be described reliably, like an object
+        implemented in C with no attributes to describe it by, or one
+        that refers back to itself. Results for it shouldn't be cached.
+
+    """
+    if thing is None or isinstance(thing, (bool, int, long, float, complex,
+                                           basestring)):
+        return repr(thing)
+    if id(thing) in describing:
+        raise ValueError("Can't describe {!r} for a cache key, since it "
+                         "refers to itself".format(thing))
+    describing.add(id(thing))
+    try:
+        return describe_object(thing)
+    finally:
+        describing.discard(id(thing))
+
+
+def describe_object(thing):
+    """Describe anything but a plain value, as for `describe`."""
+    import functools
+    import re
+    if isinstance(thing, Distance):
+        return thing.describe()
+    if isinstance(thing, types.FunctionType):
+        parts = [thing.__module__, thing.__name__, describe(thing.__code__)]
+        for cell in thing.__closure__ or ():
+            parts.append(describe(cell.cell_contents))
+        return '({})'.format(' '.join(parts))
+    if isinstance(thing, types.MethodType):
+        return '(method {} {})'.format(describe(thing.im_func),
+                                       describe(thing.im_self))
+    if isinstance(thing, functools.partial):
+        return '(partial {} {} {})'.format(describe(thing.func),
+                                           describe(thing.args),
+                                           describe(thing.keywords))
+    if isinstance(thing, (staticmethod, classmethod)):
+        return describe(thing.__func__)
+    if isinstance(thing, property):
+        return '(property {})'.format(
+            describe((thing.fget, thing.fset, thing.fdel)))
+    if isinstance(thing, types.CodeType):
+        consts = ' '.join(describe(const) for const in thing.co_consts)
+        return '({} {} {})'.format(thing.co_code.encode('hex'),
+                                   consts, ' '.join(thing.co_names))
+    if isinstance(thing, types.BuiltinFunctionType):
+        name = '{}.{}'.format(thing.__module__, thing.__name__)
+        if thing.__self__ is None:
+            return name
+        return '({} {})'.format(name, describe(thing.__self__))
+    if isinstance(thing, (type(str.lower), type(str.__add__))):
+        return '{}.{}'.format(describe(thing.__objclass__), thing.__name__)
+    if isinstance(thing, types.ModuleType):
+        return thing.__name__
+    if isinstance(thing, type) and not thing.__flags__ & heap_type:
+        return '{}.{}'.format(thing.__module__, thing.__name__)
+    if isinstance(thing, (type, types.ClassType)):
+        namespace = [(name, value) for name, value in vars(thing).items()
+                     if name not in ('__dict__', '__weakref__', '__doc__',
+                                     '__module__') and
+                     not isinstance(value, (types.MemberDescriptorType,
+                                            types.GetSetDescriptorType))]
+        return '({}.{} {} {})'.format(thing.__module__, thing.__name__,
+                                      describe(thing.__bases__),
+                                      describe(sorted(namespace)))
+    if isinstance(thing, (tuple, list)):
+        return '({})'.format(' '.join(describe(x) for x in thing))
+    if isinstance(thing, (set, frozenset)):
+        return '(set {})'.format(' '.join(sorted(describe(x)
+                                                 for x in thing)))
+    if isinstance(thing, dict):
+        return '(dict {})'.format(' '.join(sorted(
+            '({} {})'.format(describe(key), describe(value))
+            for key, value in thing.items())))
+    if isinstance(thing, type(re.compile(''))):
+        return '(regex {} {})'.format(describe(thing.pattern), thing.flags)
+    if hasattr(thing, '__dict__'):
+        return '({} {})'.format(describe(type(thing)), describe(vars(thing)))
+    raise ValueError("Can't describe {!r} for a cache key".format(thing))
+
+
+cache_format = 'mergic cache 1\n'
+
+
+def cache_lines(items):
+    """Return items as lines of bytes to cache them by, and their encoding.
+
+    Byte strings are used as they are and unicode strings are encoded
+    as UTF-8, so that the lines can be hashed and written to a cache
+    entry, and read back as the same items.
+
+    Returns
+    -------
+    tuple or None
+        The lines and the encoding to decode them with (None for byte
+        strings), or None if the items can't be cached as lines: if
+        they aren't all byte strings or all unicode, or hold newlines.
+
+    """
+    if all(type(item) is str for item in items):
+        lines, encoding = items, None
+    elif all(type(item) is unicode for item in items):
+        lines, encoding = [item.encode('utf-8') for item in items], 'utf-8'
+    else:
+        return None
+    if any('\n' in line for line in lines):
+        return None
+    return lines, encoding
+
+
+def cache_key(items, *parts):
+    """Hash items and descriptions of how they are processed.
+
+    Parameters
+    ----------
+    items : list
+        Lines of input, as byte strings (see `cache_lines`).
+    parts : strings
+        Descriptions of anything else the cached results depend on.
+
+    Returns
+    -------
+    str
+        A hexadecimal digest identifying the input and its processing.
+
+    """
+    import hashlib
+    digest = hashlib.sha1(cache_format)
+    for part in parts:
+        digest.update(part + '\n')
+    for item in items:
+        digest.update(item + '\n')
+    return digest.hexdigest()
+
+
+def write_cache(path, ordered_items, merges, cutoffs, lines=None,
+                encoding=None):
+    """Write the results of `calc` to a cache directory.
+
+    Items are written as lines of text, encoded with `encoding` if
+    they are unicode, which is recorded to decode them with. Merges
+    are written as arrays of item ids (indices into `ordered_items`)
+    and distances, and cutoffs as an array of distances. Distances
+    that are all ints are written as integers, and all floats as
+    doubles. `lines`, the number of input lines, is recorded so that
+    `find_prefix` can find the entry again.
+
+    Returns
+    -------
+    boolean
+        True if the cache was written, False if distances aren't
+        numbers that can be stored so they read back as the same
+        type, like a mix of ints and floats.
+
+    """
+    distances = cutoffs + [merge[0] for merge in merges]
+    if all(type(d) is int for d in distances):
+        typecode = 'l'
+    elif all(type(d) is float for d in distances):
+        typecode = 'd'
+    else:
+        return False
+    import shutil
+    import tempfile
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    temporary = tempfile.mkdtemp(dir=parent)
+    ids = {item: i for i, item in enumerate(ordered_items)}
+    with open(os.path.join(temporary, 'meta.json'), 'w') as f:
+        json.dump({'typecode': typecode,
+                   'items': len(ordered_items),
+                   'merges': len(merges),
+                   'cutoffs': len(cutoffs),
+                   'lines': lines,
+                   'encoding': encoding}, f)
+    with open(os.path.join(temporary, 'items.txt'), 'wb') as f:
+        if encoding is not None:
+            ordered_items = [item.encode(encoding) for item in ordered_items]
+        f.write('\n'.join(ordered_items))
+    with open(os.path.join(temporary, 'merges.bin'), 'wb') as f:
+        array('i', [ids[merge[1]] for merge in merges]).tofile(f)
+        array('i', [ids[merge[2]] for merge in merges]).tofile(f)
+        array(typecode, [merge[0] for merge in merges]).tofile(f)
+    with open(os.path.join(temporary, 'cutoffs.bin'), 'wb') as f:
+        array(typecode, cutoffs).tofile(f)
+    try:
+        os.rename(temporary, path)
+    except OSError:
+        # another process wrote the same entry first
+        shutil.rmtree(temporary)
+    return True
+
+
+def read_cache(path):
+    """Read the results of `calc` from a cache directory.
+
+    Returns
+    -------
+    tuple or None
+        Ordered items, merges and cutoffs, as written by `write_cache`,
+        or None if there is no complete cache entry at `path`.
+
+    """
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, 'items.txt'), 'rb') as f:
+            ordered_items = f.read().split('\n')
+        if meta.get('encoding') is not None:
+            ordered_items = [item.decode(meta['encoding'])
+                             for item in ordered_items]
+        typecode = str(meta['typecode'])
+        one, other = array('i'), array('i')
+        distances, cutoffs = array(typecode), array(typecode)
+        with open(os.path.join(path, 'merges.bin'), 'rb') as f:
+            one.fromfile(f, meta['merges'])
+            other.fromfile(f, meta['merges'])
+            distances.fromfile(f, meta['merges'])
+        with open(os.path.join(path, 'cutoffs.bin'), 'rb') as f:
+            cutoffs.fromfile(f, meta['cutoffs'])
+    except (IOError, OSError, ValueError, EOFError):
+        return None
+    if meta['items'] == 0:
+        ordered_items = []
+    merges = [(distance, ordered_items[i], ordered_items[j])
+              for distance, i, j in zip(distances, one, other)]
+    os.utime(path, None)
+    return ordered_items, merges, cutoffs.tolist()
+
+
+def find_prefix(cache_dir, items, *parts):
+    """Find the cache entry for the longest prefix of some input.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of cache entries.
+    items : list
+        Lines of input, as byte strings (see `cache_lines`).
+    parts : strings
+        Descriptions of anything else the cached results depend on, as
+        for `cache_key`.
+
+    Returns
+    -------
+    tuple or None
+        The number of lines in the prefix and the path of its entry, or
+        None if no entry has a (shorter) prefix of `items` as its input.
+
+    """
+    if not os.path.isdir(cache_dir):
+        return None
+    wanted = {}
+    for name in os.listdir(cache_dir):
+        try:
+            with open(os.path.join(cache_dir, name, 'meta.json')) as f:
+                lines = json.load(f).get('lines')
+        except (IOError, OSError, ValueError):
+            continue
+        if lines is not None and lines < len(items):
+            wanted.setdefault(lines, []).append(name)
+    # hash every prefix in one pass, as `cache_key` would
+    import hashlib
+    digest = hashlib.sha1(cache_format)
+    for part in parts:
+        digest.update(part + '\n')
+    found = None
+    for k in xrange(max(wanted) + 1 if wanted else 0):
+        if k in wanted and digest.hexdigest() in wanted[k]:
+            found = k, os.path.join(cache_dir, digest.hexdigest())
+        digest.update(items[k] + '\n')
+    return found
+
+
+def evict_cache(cache_dir, keep):
+    """Remove all but the `keep` most recently used cache entries."""
+    import shutil
+    entries = [os.path.join(cache_dir, name)
+               for name in os.listdir(cache_dir)
+               if len(name) == 40]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for path in entries[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _fit(self, items, cache=None, update=False):
+    """Calculate how items merge into groups at every cutoff.
+
+    Parameters
+    ----------
+    items : list
+        Items to group, like the lines of a file. Items may appear more
+        than once.
+
+    cache : dict-like or None (default=None)
+        A mapping to look up and keep results in, by a key made from
+        the items, distance and blocker, in place of the cache
+        directory. A dict kept between calls makes refitting the same
+        items fast without touching the disk.
+
+    update : boolean (default=False)
+        If True and the items aren't in the cache directory, reuse the
+        entry for the longest cached prefix of the items, and only
+        calculate distances for pairs with the items after it. If the
+        distance or blocker depends on the other items (see
+        `Distance`), everything is calculated again instead.
+
+    Returns
+    -------
+    Blender
+        This Blender, with `links_at`, `cutoffs`, `merges`,
+        `ordered_items` and `position` set, ready for `summary` and
+        `partition`.
+
+    """
+    cached = previous = path = key = None
+    if cache is not None or self.cache_dir is not None:
+        phase(self.stats, 'cache')
+        found = cache_lines(items)
+        try:
+            parts = describe(self.distance), describe(self.blocker)
+        except ValueError:
+            found = None
+        if found is None:
+            # Results for items, a distance or a blocker that can't be
+            # told apart from others can't be cached safely.
+            cache = None
+        else:
+            lines, encoding = found
+            if encoding is not None:
+                parts += (encoding,)
+            key = cache_key(lines, *parts)
+    if key is None:
+        pass
+    elif cache is not None:
+        cached = cache.get(key)
+    else:
+        path = os.path.join(self.cache_dir, key)
+        cached = read_cache(path)
+        if (cached is None and self.max_distance is None and update and
+                not self.distance.depends_on_items and
+                not getattr(self.blocker, 'depends_on_items', False)):
+            found = find_prefix(self.cache_dir, lines, *parts)
+            if found is not None:
+                previous = (found[0],) + (read_cache(found[1]) or (None,))
+                if previous[-1] is None:
+                    previous = None
+            if self.stats is not None and previous is not None:
+                self.stats.count('cache_updates')
+    if self.stats is not None and key is not None:
+        self.stats.count('cache_hits' if cached else 'cache_misses')
+    if cached is not None:
+        self.ordered_items, self.merges, self.cutoffs = cached
+        items = self.ordered_items
+        self.links_at = {}
+        for distance, one, other in self.merges:
+            self.links_at.setdefault(distance, []).append((one, other))
+    else:
+        phase(self.stats, 'distances')
+        self.distance.fit(list(OrderedDict.fromkeys(items)))
+        if previous is not None:
+            # Appending lines leaves the positions of the old ones as
+            # they were, so the old merges keep their place in the
+            # order links are considered, and the new spanning tree is
+            # within the old merges and the pairs with new lines.
+            start, _, old_merges, old_cutoffs = previous
+            positions = {}
+            for i, item in enumerate(items):
+                positions.setdefault(item, []).append(i)
+            old_links = []
+            for distance, one, other in old_merges:
+                p = positions[one][0]
+                found = positions[other]
+                q = found[bisect(found, p)]
+                old_links.append((distance, p, q))
+            if self.memory_budget is not None:
+                links_at, distances = self.spilled_links(items, start,
+                                                         old_links)
+                distances = set(distances) | set(old_cutoffs)
+            else:
+                links_at = self.links(items, start)
+                distances = set(links_at) | set(old_cutoffs)
+                for distance, p, q in old_links:
+                    links_at.setdefault(distance, []).append((p, q))
+        elif self.engine == 'mst' and self.max_distance is None:
+            links_at, distances = self.spanning_tree(items)
+        elif self.memory_budget is not None:
+            links_at, distances = self.spilled_links(items)
+        else:
+            links_at = self.links(items)
+            distances = links_at.keys()
+        if (self.engine != 'mst' or previous is not None or
+                self.max_distance is not None):
+            for distance, pairs in links_at.items():
+                pairs.sort()
+                links_at[distance] = [(items[p], items[q])
+                                      for p, q in pairs]
+        self.links_at = links_at
+        self.cutoffs = sorted(distances)
+    phase(self.stats, 'agglomerate')
+    group_for_item = Grouping(items)
+    self.steps = [(len(group_for_item), 1, 0, (self.cutoffs or [0])[0] - 1)]
+    merges = []
+    for cutoff in self.cutoffs:
+        for one, other in self.links_at.get(cutoff, []):
+            if group_for_item.union(one, other):
+                merges.append((cutoff, one, other))
+        self.steps.append((len(group_for_item),
+                           group_for_item.max_size,
+                           group_for_item.num_pairs,
+                           cutoff))
+        if len(group_for_item) == 1:
+            break
+    self.merges = merges
+    self.ordered_items = order_groups(group_for_item.groups(), items)
+    self.position = {item: i for i, item in enumerate(self.ordered_items)}
+    if cached is None and self.max_distance is None and key is not None:
+        if cache is not None:
+            cache[key] = self.ordered_items, merges, self.cutoffs
+        elif path is not None:
+            phase(self.stats, 'cache')
+            if write_cache(path, self.ordered_items, merges, self.cutoffs,
+                           len(items), encoding):
+                evict_cache(self.cache_dir, self.cache_size)
+    return self
+
+
+def _summary(self, step=None, quantiles=None):
+    """Summarize the groupings at each cutoff, once fit.
+
+    Parameters
+    ----------
+    step : number or None (default=None)
+        Only summarize the largest cutoff in each interval of this
+        width.
+
+    quantiles : int or None (default=None)
+        Only summarize the cutoffs at this many evenly spaced quantiles
+        of the cutoffs before everything is in one group.
 
     Returns
     -------
-    int
-        The number of items partitioned by the partition.
-
-    Raises
-    ------
-    ValueError
-        If a value appears more than once in one value list
-        or a value appears in more than one value list.
+    list
+        Tuples of the number of groups, the size of the largest group,
+        the number of pairs within groups and the cutoff. The first is
+        for a cutoff below every distance, where each item is alone, and
+        the last is where everything is first in one group, if it ever
+        is.
 
     """
-    all_items = set()
-    for values in partition.values():
-        value_set = set(values)
-        if len(values) != len(value_set):
-            raise ValueError('Duplication in {}'.format(values))
-        already_seen = list(all_items & value_set)
-        if len(already_seen) != 0:
-            raise ValueError('{} in more than one group'.format(already_seen))
-        all_items.update(values)
-    return len(all_items)
+    steps = self.steps[1:]
+    report = report_cutoffs([cutoff for _, _, _, cutoff in steps],
+                            step, quantiles)
+    return self.steps[:1] + [row for k, row in enumerate(steps)
+                             if k in report or row[0] == 1]
 
 
-def check_(args):
-    """Check a partition loaded from a file at the command line."""
-    data = json.loads(args.partition.read())
-    n = check(data)
-    print "{} items in {} groups".format(n, len(data))
+def partition_pairs(pairs):
+    """Make a partition from pairs of items that belong together.
 
+    Parameters
+    ----------
+    pairs : list
+        Pairs of items, like the rows of a file of known duplicates.
 
-def link_items(group_of, links):
-    """Put items that are linked into the same group.
+    Returns
+    -------
+    OrderedDict
+        Lists of the items linked together through the pairs, keyed by
+        their first member.
+
+    """
+    grouping = Grouping(item for pair in pairs for item in pair)
+    for one, other in pairs:
+        grouping.union(one, other)
+    return OrderedDict((group[0], list(group))
+                       for group in grouping.groups())
+
+
+def true_pairs(items, merges, truth):
+    """Count the pairs grouped together that are also together in truth.
+
+    The merges are replayed with a count of each group's members in
+    each true group, merging the smaller count into the larger, so this
+    takes about n log n steps for n items and calculates no distances.
 
     Parameters
     ----------
-    group_of : dict
-        Keys are items being partitioned and values are tuples representing
-        the group that the key is currently assigned to. Usually starts as
-        every item pointing to a tuple containing only the item itself.
-    links : list
-        Contains tuples (pairs) representing items to link.
+    items : list
+        Unique items, like `Blender.ordered_items`.
+    merges : list
+        Merges of the items, like `Blender.merges`.
+    truth : dict
+        A partition dictionary of the true groups. Items that aren't in
+        it are in true groups by themselves.
+
+    Returns
+    -------
+    tuple
+        The number of pairs of items that are together in truth, and a
+        list of the number of those pairs grouped together after each
+        merge.
 
     """
-    for one, other in links:
-        if group_of[one] is group_of[other]:
-            continue
-        else:
-            union = group_of[one] + group_of[other]
-            for thing in union:
-                group_of[thing] = union
+    true_group = index_partition(truth)
+    grouping = Grouping(items)
+    counts = {}
+    sizes = {}
+    for item in items:
+        key = true_group.get(item, (item,))
+        counts[item] = {key: 1}
+        sizes[key] = sizes.get(key, 0) + 1
+    total = sum(n * (n - 1) // 2 for n in sizes.values())
+    found = 0
+    result = []
+    for _, one, other in merges:
+        one, other = grouping.find(one), grouping.find(other)
+        larger, smaller = counts.pop(one), counts.pop(other)
+        if len(larger) < len(smaller):
+            larger, smaller = smaller, larger
+        for key, n in smaller.items():
+            found += n * larger.get(key, 0)
+            larger[key] = larger.get(key, 0) + n
+        grouping.union(one, other)
+        counts[grouping.find(one)] = larger
+        result.append(found)
+    return total, result
 
 
-def diff(first, second):
-    """Generate the differences from a first to a second partition.
+def _signals(self, truth=None):
+    """Calculate signals for choosing a cutoff, once fit.
+
+    Signals come from the summary and the merges, without calculating
+    any distances. A good cutoff is often just before a big change: a
+    large gap before the next cutoff, and large growth of the groups
+    at the next cutoff.
 
     Parameters
     ----------
-    first  : dict
-    second : dict
-        Partition dictionaries where the values are lists. In each,
-        items appear exactly once through all the value lists (they
-        are "assigned to" their key value.)
+    truth : dict or None (default=None)
+        A partition dictionary of the true groups of (some of) the
+        items, to score pairs grouped together at each cutoff.
 
     Returns
     -------
-    dict
-        A "patch" partition, for the set of values that are assigned
-        differently in the second partition than the first. It can be
-        applied to the first partition to generate the second.
+    list
+        A tuple for each cutoff that has a next one, before everything
+        is in one group: the cutoff; the gap to the next cutoff,
+        relative to the median gap; the growth at the next cutoff (the
+        mean of the logarithms of the growth of the largest group and
+        of the number of pairs within groups); a score, the relative
+        gap times the growth; and with `truth`, the precision, recall
+        and F1 score of the pairs within groups, otherwise None.
 
-    Raises
-    ------
-    ValueError
-        If a value in the first partition is not assigned anywhere in
-        the second partition or if the second partition assigns a
-        value not found in the first partition.
+    """
+    steps = self.steps[1:]
+    gaps = [after[3] - before[3] for before, after in zip(steps, steps[1:])]
+    median = sorted(gaps)[len(gaps) // 2] if gaps else None
+    if truth is not None:
+        total, found = true_pairs(self.ordered_items, self.merges, truth)
+        merges = iter(zip(self.merges, found))
+        merge = next(merges, None)
+        true_found = 0
+    rows = []
+    for before, after, gap in zip(steps, steps[1:], gaps):
+        growth = (math.log(float(after[1]) / before[1]) +
+                  math.log((after[2] + 1.0) / (before[2] + 1))) / 2
+        precision = recall = f1 = None
+        if truth is not None:
+            while merge is not None and merge[0][0] <= before[3]:
+                true_found = merge[1]
+                merge = next(merges, None)
+            precision = float(true_found) / before[2] if before[2] else None
+            recall = float(true_found) / total if total else None
+            f1 = (2 * precision * recall / (precision + recall)
+                  if true_found else 0.0)
+        relative = float(gap) / median
+        rows.append((before[3], relative, growth, relative * growth,
+                     precision, recall, f1))
+    return rows
+
+
+def _suggest(self, n=3, truth=None):
+    """Suggest cutoffs, once fit.
+
+    Returns
+    -------
+    list
+        The `n` rows of `signals` with the best F1 scores against
+        `truth`, if given, or otherwise with the highest scores.
 
     """
-    mixed_from = set()
-    mixed_to = set()
-    patch = dict()
-    for key, values in second.items():
-        if set(first.get(key, [])) == set(values):
-            del(first[key])
-        else:
-            patch[key] = values
-            mixed_to.update(values)
-            to_find = mixed_to - mixed_from
-            for key_from, values_from in first.items():
-                values_from = set(values_from)
-                if to_find & values_from:
-                    mixed_from.update(values_from)
-                    del(first[key_from])
-            not_found = to_find - mixed_from
-            if not_found:
-                raise ValueError(not_found)
-    if mixed_from != mixed_to:
-        not_assigned = mixed_from - mixed_to
-        raise ValueError(not_assigned)
-    return patch
+    column = 3 if truth is None else 6
+    return sorted(self.signals(truth), key=lambda row: -row[column])[:n]
 
 
-def diff_(args):
-    """Check and diff two partitions loaded from files at the command line."""
-    first = json.loads(args.first.read())
-    check(first)
-    second = json.loads(args.second.read())
-    check(second)
-    patch = diff(first, second)
-    print pretty_json(patch)
+def _partition(self, cutoff):
+    """Return the partition at a cutoff, once fit.
+
+    Returns
+    -------
+    OrderedDict
+        Lists of the items in each group, by the key of the group, with
+        the largest groups first.
 
+    """
+    return next(self.partitions([cutoff]))[1]
 
-def equal(first, second):
-    """Check a first and second partition for equality.
+
+def read_items(f):
+    """Read the lines of a file as items to group."""
+    return [item.strip() for item in f.readlines()]
+
+
+def _calc_(self, args):
+    """Calculate possible groupings and print out a summary."""
+    phase(self.stats, 'read')
+    self.fit(read_items(args.infile), update=args.update)
+    print "num groups, max group, num pairs, cutoff"
+    print "----------------------------------------"
+    for data in self.summary(args.step, args.quantiles):
+        print "{0: >10}, {1: >9}, {2: >9}, {3}".format(*data)
+    if args.suggest is None:
+        return
+    truth = None
+    if args.truth is not None:
+        truth = OrderedDict((key, [value.encode('utf-8')
+                                   for value in values])
+                            for key, values in read_partition(args.truth))
+    elif args.truth_pairs is not None:
+        truth = partition_pairs(list(csv.reader(args.truth_pairs)))
+    columns = ['suggested cutoff', 'gap', 'growth', 'score']
+    if truth is not None:
+        columns += ['precision', 'recall', 'f1']
+    header = ', '.join(["{0: >16}".format(columns[0])] +
+                       ["{0: >9}".format(x) for x in columns[1:]])
+    print
+    print header
+    print '-' * len(header)
+    for row in self.suggest(args.suggest, truth):
+        data = ['{:.3f}'.format(x) if x is not None else '-'
+                for x in row[1:len(columns)]]
+        print ', '.join(["{0: >16}".format(row[0])] +
+                        ["{0: >9}".format(x) for x in data])
+
+
+def _partitions(self, cutoffs):
+    """Generate partitions at several cutoffs in one pass.
 
     Parameters
     ----------
-    first  : dict
-    second : dict
-        Partition dictionaries where the values are lists. In each,
-        items appear exactly once through all the value lists (they
-        are "assigned to" their key value.)
+    cutoffs : list
+        Cutoffs to make partitions at.
 
-    Returns
-    -------
-    boolean
-        True if the difference is empty, otherwise False.
+    Yields
+    ------
+    tuple
+        Each cutoff, in sorted order, and its partition as an ordered
+        dict with the largest groups first.
+
+    Raises
+    ------
+    ValueError
+        If a cutoff is greater than the `max_distance` that distances
+        were calculated up to.
 
     """
-    try:
-        patch = diff(first, second)
-        if patch == {}:
-            return True
-    except ValueError:
-        pass
-    return False
+    if (self.max_distance is not None and cutoffs and
+            max(cutoffs) > self.max_distance):
+        raise ValueError('Distances were only calculated up to '
+                         '{}'.format(self.max_distance))
+    grouping = Grouping(self.ordered_items)
+    merges = iter(self.merges)
+    merge = next(merges, None)
+    for cutoff in sorted(cutoffs):
+        while merge is not None and merge[0] <= cutoff:
+            grouping.union(merge[1], merge[2])
+            merge = next(merges, None)
+        all_groups = grouping.groups()
+        all_groups.sort(key=lambda x: (0-len(x), self.position[x[0]]))
+        result = OrderedDict()
+        for item in all_groups:
+            result[self.key_method(item)] = list(item)
+        yield cutoff, result
 
 
-def apply_diff(partition, patch):
-    """Apply a patch to a partition (in place).
+def _make_(self, args):
+    """Generate and print out a partition at a cutoff."""
+    if args.cutoffs is None:
+        names = None
+        cutoffs = [args.cutoff]
+    else:
+        names = dict(args.cutoffs)
+        cutoffs = names.keys()
+    if self.merges is None:
+        if args.bounded:
+            self.max_distance = max(cutoffs)
+        phase(self.stats, 'read')
+        self.fit(read_items(args.infile), update=args.update)
+    phase(self.stats, 'output')
+    if names is None:
+        for cutoff, result in self.partitions(cutoffs):
+            write_partition(result.items(), sys.stdout, args.binary)
+        return
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    extension = '.mergic' if args.binary else '.json'
+    for cutoff, result in self.partitions(names.keys()):
+        path = os.path.join(args.outdir, names[cutoff] + extension)
+        with open(path, 'wb') as f:
+            write_partition(result.items(), f, args.binary)
+
+
+def _assign(self, partition, items, cutoff, index=None):
+    """Assign new items to the groups of a partition.
+
+    Each item joins the group of its nearest member, if that member is
+    within `cutoff`, and otherwise starts a new group of its own.
+    Assigned items are added to the index as they go, so later items
+    can join the groups of earlier ones. An item that is the key of a
+    group joins that group.
 
     Parameters
     ----------
@@ -184,142 +3348,252 @@ def apply_diff(partition, patch):
         exactly once through all the value lists (they are "assigned to"
         their key value.)
 
-    patch : dict
-        A "patch" partition, for the set of values that should be
-        assigned differently from how they are in the original
-        partition.
+    items : list
+        New items. Items already in the partition, and repeats, are
+        skipped.
+
+    cutoff : number
+        The largest distance at which an item joins a group.
+
+    index : class, 'scan', 'ngram', 'bktree', or None (default=None)
+        A nearest neighbour index class, like `ScanIndex`, to make with
+        the distance. The default (None) uses a `BKTree` for metric
+        distances and a `ScanIndex` otherwise.
 
     Returns
     -------
-    None
-        The `partition` passed is modified in place.
+    OrderedDict
+        A patch, like those from `diff`: each group that gains items,
+        with all its values, followed by the new groups. Apply it with
+        `allow_new`.
 
     """
-    mixed_from = set()
-    mixed_to = set()
-    for key, values in patch.items():
-        if partition.get(key) == values:
-            # this shouldn't happen, but still...
-            del(partition[key])
+    if index is None:
+        index = 'bktree' if self.distance.metric else 'scan'
+    if index in indexes:
+        index = indexes[index]
+    group_of = index_partition(partition)
+    new = [item for item in OrderedDict.fromkeys(items)
+           if item not in group_of]
+    self.distance.fit(list(OrderedDict.fromkeys(group_of.keys() + new)))
+    members = index(self.distance)
+    keys = []
+    for key, values in partition.items():
+        for value in values:
+            members.add(value)
+            keys.append(key)
+    patch = OrderedDict()
+    for item in new:
+        if item in partition:
+            key = item
         else:
-            mixed_to.update(values)
-            to_find = mixed_to - mixed_from
-            for key_from, values_from in partition.items():
-                values_from = set(values_from)
-                if to_find & values_from:
-                    mixed_from.update(values_from)
-                    del(partition[key_from])
-            not_found = to_find - mixed_from
-            if not_found:
-                raise ValueError(not_found)
-    if mixed_from != mixed_to:
-        not_assigned = mixed_from - mixed_to
-        raise ValueError(not_assigned)
-    partition.update(patch)
+            nearest = members.nearest(item, cutoff)
+            key = item if nearest is None else keys[nearest[1]]
+        if key not in patch:
+            patch[key] = list(partition.get(key, []))
+        patch[key].append(item)
+        members.add(item)
+        keys.append(key)
+    return patch
 
 
-def apply_diff_(args):
-    """Apply a patch to a partition, at the command line."""
-    partition = json.loads(args.partition.read())
-    check(partition)
-    patch = json.loads(args.patch.read())
-    apply_diff(partition, patch)
-    print pretty_json(partition)
+def _assign_(self, args):
+    """Print a patch assigning new items to groups of a partition."""
+    partition = OrderedDict(checked(read_partition(args.partition)))
+    items = [item.strip().decode('utf-8')
+             for item in args.infile.readlines()]
+    patch = self.assign(partition, items, args.cutoff, args.index)
+    write_partition(patch.items(), sys.stdout, args.binary)
 
 
-def table(partition):
-    """Generate 'merge table' rows from a partition.
+def decoded(thing):
+    """Decode a UTF-8 byte string to unicode, leaving anything else."""
+    if isinstance(thing, str):
+        return thing.decode('utf-8')
+    return thing
+
+
+class Partitions(object):
+    """Partitions of a fitted Blender, shared between threads.
+
+    A partition is made at most once for each distinct grouping, since
+    every cutoff between two neighbouring distances gives the same one,
+    and the most recently used ones are kept along with their JSON.
+
+    """
+
+    def __init__(self, blender, cache_size=32):
+        import threading
+        self.blender = blender
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, cutoff):
+        """Return the partition at a cutoff and its JSON.
+
+        Raises
+        ------
+        ValueError
+            If the cutoff is past the Blender's `max_distance`.
+
+        """
+        step = bisect(self.blender.cutoffs, cutoff)
+        with self.lock:
+            if step in self.cache:
+                self.cache[step] = self.cache.pop(step)
+                return self.cache[step]
+            partition = OrderedDict(
+                (decoded(key), [decoded(value) for value in values])
+                for key, values in self.blender.partition(cutoff).items())
+            self.cache[step] = partition, pretty_json(partition) + '\n'
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return self.cache[step]
+
+
+def groups_json(groups):
+    """Return groups as the JSON that `write_groups` writes."""
+    out = StringIO()
+    write_groups(groups, out)
+    return out.getvalue()
+
+
+def make_server(address, blender, cache_size=32, quiet=False):
+    """Make an HTTP server that answers from a fitted Blender in memory.
+
+    The server answers these requests, each in its own thread:
+
+    GET /summary
+        The rows of the `calc` summary, with optional `step` and
+        `quantiles` parameters.
+    GET /partition?cutoff=X
+        The partition at a cutoff, as `make` writes it.
+    POST /diff?cutoff=X
+        A patch from the partition at a cutoff to the partition in the
+        request body.
+    POST /apply?cutoff=X
+        The partition at a cutoff with the patch in the request body
+        applied, adding new values with `allow_new=1`.
+
+    Partitions in request bodies can be JSON or binary. Bad requests
+    get a 400 response with the error as text.
 
     Parameters
     ----------
-    partition : dict
-        A partition dictionary where the values are lists. Items appear
-        exactly once through all the value lists (they are "assigned to"
-        their key value.)
+    address : tuple
+        The host and port to listen on. Port 0 picks a free port.
+    blender : Blender
+        A fitted Blender.
+    cache_size : int (default=32)
+        How many partitions to keep.
+    quiet : boolean (default=False)
+        If True, don't log each request to standard error.
 
-    Yields
-    ------
-    tuple
-        Pairs of original and new names, as specified in the partition.
+    Returns
+    -------
+    server
+        A threading `HTTPServer`, with the `Partitions` it answers from
+        as its `partitions`. Call its `serve_forever` method to start.
 
     """
-    for key, values in partition.items():
-        for value in values:
-            yield (value, key)
+    # The HTTP modules are slow to import, so only serve imports them.
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    import urlparse
 
+    class Handler(BaseHTTPRequestHandler):
 
-def table_(args):
-    """Print out a two-column 'merge table' at the command line."""
-    partition = json.loads(args.partition.read())
-    check(partition)
-    writer = csv.writer(sys.stdout)
-    writer.writerow(["original", "mergic"])
-    for row in table(partition):
-        row = [str(element).encode('utf-8') for element in row]
-        writer.writerow(row)
+        def do_GET(self):
+            self.answer('GET')
 
+        def do_POST(self):
+            self.answer('POST')
 
-def _calc_(self, args):
-    """Calculate possible groupings and print out a summary."""
-    try:
-        with open('.mergic_cache', 'rb') as f:
-            cache = pickle.load(f)
-            (self.links_at, self.cutoffs, self.ordered_items) = cache
-            items = self.ordered_items
-    except IOError:
-        items = [item.strip() for item in args.infile.readlines()]
-        # build distance "matrix"
-        links_at = {}
-        for one, other in combinations(items, 2):
-            links_at.setdefault(self.distance(one, other),
-                                []).append((one, other))
-        self.links_at = links_at
-        self.cutoffs = sorted(links_at.keys())
-    links_at = self.links_at
-    cutoffs = self.cutoffs
-    group_for_item = {item: (item,) for item in items}
-    if args.command == 'calc':
-        print "num groups, max group, num pairs, cutoff"
-        print "----------------------------------------"
-        data = (len(group_for_item), 1, 0, cutoffs[0] - 1)
-        print "{0: >10}, {1: >9}, {2: >9}, {3}".format(*data)
-    for cutoff in cutoffs:
-        link_items(group_for_item, links_at[cutoff])
-        all_groups = set(group_for_item.values())
-        c = Counter(len(x) for x in all_groups)
-        if args.command == 'calc':
-            data = (sum(c.values()),
-                    max(c.keys()),
-                    sum(len(x)*(len(x)-1)/2 for x in all_groups),
-                    cutoff)
-            print "{0: >10}, {1: >9}, {2: >9}, {3}".format(*data)
-        if sum(c.values()) == 1:
-            break
-    self.ordered_items = group_for_item.values()[0]
-    with open('.mergic_cache', 'wb') as f:
-        pickle.dump((self.links_at, self.cutoffs, self.ordered_items),
-                    f, protocol=2)
+        def answer(self, method):
+            url = urlparse.urlsplit(self.path)
+            query = dict(urlparse.parse_qsl(url.query))
+            route = (method, url.path.rstrip('/'))
+            try:
+                if route == ('GET', '/summary'):
+                    body = self.summary(query)
+                elif route == ('GET', '/partition'):
+                    body = self.partition(query)[1]
+                elif route == ('POST', '/diff'):
+                    patch = diff(self.partition(query)[0], self.read_body())
+                    body = groups_json(patch.items())
+                elif route == ('POST', '/apply'):
+                    allow_new = query.get('allow_new') in ('1', 'true')
+                    body = groups_json(apply_groups(
+                        self.partition(query)[0].items(), self.read_body(),
+                        allow_new))
+                else:
+                    self.send_error(404)
+                    return
+            except ValueError as e:
+                self.send_response(400)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.end_headers()
+                self.wfile.write(str(e) + '\n')
+                return
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
 
+        def log_message(self, *args):
+            if not quiet:
+                BaseHTTPRequestHandler.log_message(self, *args)
+
+        def partition(self, query):
+            if 'cutoff' not in query:
+                raise ValueError('give a cutoff')
+            return self.server.partitions.get(float(query['cutoff']))
+
+        def summary(self, query):
+            step = query.get('step')
+            quantiles = query.get('quantiles')
+            rows = blender.summary(
+                None if step is None else float(step),
+                None if quantiles is None else int(quantiles))
+            columns = ['num groups', 'max group', 'num pairs', 'cutoff']
+            return pretty_json(OrderedDict([('columns', columns),
+                                            ('rows', rows)])) + '\n'
+
+        def read_body(self):
+            length = int(self.headers.getheader('Content-Length', 0))
+            data = StringIO(self.rfile.read(length))
+            return OrderedDict(checked(read_partition(data)))
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Server(address, Handler)
+    server.partitions = Partitions(blender, cache_size)
+    return server
 
-def _make_(self, args):
-    """Generate and print out a partition at a cutoff."""
-    if self.links_at is None:
-        self.calc(args)
-    links_at = self.links_at
-    # NOT DRY (copied from above)
-    group_for_item = {item: (item,) for item in self.ordered_items}
-    for cutoff in [x for x in self.cutoffs if x <= args.cutoff]:
-        link_items(group_for_item, links_at[cutoff])
-    all_groups = list(set(group_for_item.values()))
-    all_groups.sort(key=lambda x: (0-len(x), self.ordered_items.index(x[0])))
-    result = OrderedDict()
-    for item in all_groups:
-        result[self.key_method(item)] = list(item)
-    print pretty_json(result)
+
+def _serve_(self, args):
+    """Fit items and answer requests about them over HTTP."""
+    phase(self.stats, 'read')
+    self.fit(read_items(args.infile), update=args.update)
+    phase(self.stats, None)
+    server = make_server((args.host, args.port), self, quiet=args.quiet)
+    host, port = server.server_address[:2]
+    print >> sys.stderr, 'serving on http://{}:{}/'.format(host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 def _script(self):
     """Parse command-line arguments and expose functionality."""
+    import argparse
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-V', '--version',
@@ -328,67 +3602,301 @@ def _script(self):
 
     subparsers = parser.add_subparsers(dest='command')
 
+    p_blender = argparse.ArgumentParser(add_help=False)
+    p_blender.add_argument('--block',
+                           help='only calculate distances for candidate '
+                                'pairs found by a blocker',
+                           choices=sorted(blockers.keys()))
+    p_blender.add_argument('--distance',
+                           help='a built-in distance to use',
+                           choices=sorted(builtin_distances.keys()))
+    p_blender.add_argument('--field',
+                           help='treat lines as CSV records and add the '
+                                'distance between this field (counting '
+                                'from 1) to the distance between records, '
+                                'using a built-in distance (default: '
+                                '--distance, or stock) and weight '
+                                '(default: 1); give once for each field',
+                           metavar='COLUMN[:DISTANCE[:WEIGHT]]',
+                           type=field_spec,
+                           action='append')
+    p_blender.add_argument('--block-field',
+                           help='only calculate distances for CSV records '
+                                'that have the same value in this field '
+                                '(counting from 1); give more than once '
+                                'to pair records that agree on any of them',
+                           metavar='COLUMN',
+                           type=column_spec,
+                           action='append')
+    p_blender.add_argument('-j', '--jobs',
+                           help='number of processes to calculate '
+                                'distances with',
+                           type=int)
+    p_blender.add_argument('--cache-dir',
+                           help='directory to cache calculations in '
+                                '(default: .mergic)')
+    p_blender.add_argument('--update',
+                           help='reuse the cached calculation for the '
+                                'input without its last lines, and only '
+                                'calculate distances for the new lines',
+                           action='store_true')
+    p_blender.add_argument('--stats',
+                           help='write timings and counts as JSON to '
+                                'standard error',
+                           action='store_true')
+    p_blender.add_argument('--memory-budget',
+                           help='with the pairs engine, keep about this '
+                                'many megabytes of links in memory, and '
+                                'sort and spill the rest to temporary '
+                                'files',
+                           metavar='MB',
+                           type=float)
+    p_blender.add_argument('--engine',
+                           help='how to find links: between all pairs, or '
+                                'only along a minimum spanning tree',
+                           choices=['pairs', 'mst'])
+
+    p_output = argparse.ArgumentParser(add_help=False)
+    p_output.add_argument('--binary',
+                          help='write a binary partition instead of JSON',
+                          action='store_true')
+
     p_calc = subparsers.add_parser('calc',
+                                   parents=[p_blender],
                                    help='calculate all partitions of data')
     p_calc.add_argument('infile',
                         nargs='?',
                         help='lines of text to calculate groups for',
                         type=argparse.FileType('r'),
                         default=sys.stdin)
+    p_calc.add_argument('--step',
+                        help='only report the largest cutoff in each '
+                             'interval of this width',
+                        type=positive_number)
+    p_calc.add_argument('--quantiles',
+                        help='only report cutoffs at this many evenly '
+                             'spaced quantiles',
+                        type=whole_number)
+    p_calc.add_argument('--suggest',
+                        help='after the summary, suggest this many '
+                             'cutoffs',
+                        type=int)
+    p_calc.add_argument('--truth',
+                        help='a partition of true groups to score '
+                             'suggested cutoffs against',
+                        type=argparse.FileType('rb'))
+    p_calc.add_argument('--truth-pairs',
+                        help='a CSV file of pairs of true duplicates to '
+                             'score suggested cutoffs against',
+                        type=argparse.FileType('rb'))
     p_calc.set_defaults(func=self.calc)
 
     p_make = subparsers.add_parser('make',
+                                   parents=[p_blender, p_output],
                                    help='make a JSON partition from data')
+    # infile is opened once the cutoff is known, since with one
+    # argument and no --cutoffs, the argument is the cutoff
     p_make.add_argument('infile',
                         nargs='?',
-                        help='lines of text to make a partition for',
-                        type=argparse.FileType('r'),
-                        default=sys.stdin)
+                        help='lines of text to make a partition for')
     p_make.add_argument('cutoff',
+                        nargs='?',
                         help="cutoff for partition",
                         type=float)
+    p_make.add_argument('--cutoffs',
+                        help='comma-separated cutoffs to make partitions '
+                             'for, written to files in --outdir',
+                        type=cutoff_list)
+    p_make.add_argument('--outdir',
+                        help='directory to write partitions for --cutoffs '
+                             'to, one file per cutoff')
+    p_make.add_argument('--bounded',
+                        help='only calculate distances up to the largest '
+                             'cutoff, abandoning pairs that are further '
+                             'apart (nothing is cached)',
+                        action='store_true')
     p_make.set_defaults(func=self.make)
 
     p_check = subparsers.add_parser('check',
-                                    help='check validity of JSON partition')
-    p_check.add_argument('partition',
-                         nargs='?',
-                         help='a JSON partition file',
-                         type=argparse.FileType('r'),
-                         default=sys.stdin)
+                                    help='check validity of partitions')
+    p_check.add_argument('partitions',
+                         nargs='*',
+                         help='JSON or binary partition files (default: '
+                              'standard input)',
+                         metavar='partition')
+    p_check.add_argument('--manifest',
+                         help='a file listing more partition files to '
+                              'check, one per line',
+                         type=argparse.FileType('r'))
     p_check.set_defaults(func=check_)
 
     p_diff = subparsers.add_parser('diff',
-                                   help='diff two JSON partitions')
+                                   parents=[p_output],
+                                   help='diff two partitions')
     p_diff.add_argument('first',
-                        help='a JSON partition file',
-                        type=argparse.FileType('r'))
+                        help='a JSON or binary partition file',
+                        type=argparse.FileType('rb'))
     p_diff.add_argument('second',
-                        help='a JSON partition file',
-                        type=argparse.FileType('r'))
+                        help='a JSON or binary partition file',
+                        type=argparse.FileType('rb'))
     p_diff.set_defaults(func=diff_)
 
     p_apply = subparsers.add_parser('apply',
-                                    help='apply a patch to a JSON partition')
+                                    parents=[p_output],
+                                    help='apply a patch to a partition')
     p_apply.add_argument('partition',
-                         help='a JSON partition file',
-                         type=argparse.FileType('r'))
+                         help='a JSON or binary partition file',
+                         type=argparse.FileType('rb'))
     p_apply.add_argument('patch',
-                         help='a JSON partition patch file',
-                         type=argparse.FileType('r'))
+                         help='a JSON or binary partition patch file',
+                         type=argparse.FileType('rb'))
+    p_apply.add_argument('--allow-new',
+                         help='add values in the patch that are not in '
+                              'the partition, as from assign',
+                         action='store_true')
     p_apply.set_defaults(func=apply_diff_)
 
-    p_table_help = 'make a merge table from a JSON partition'
+    p_assign = subparsers.add_parser('assign',
+                                     parents=[p_output],
+                                     help='make a patch assigning new '
+                                          'items to groups of a partition')
+    p_assign.add_argument('partition',
+                          help='a JSON or binary partition file',
+                          type=argparse.FileType('rb'))
+    p_assign.add_argument('infile',
+                          nargs='?',
+                          help='lines of text to assign to groups',
+                          type=argparse.FileType('r'),
+                          default=sys.stdin)
+    p_assign.add_argument('--cutoff',
+                          help='largest distance at which an item joins '
+                               'a group',
+                          type=float,
+                          required=True)
+    p_assign.add_argument('--distance',
+                          help='a built-in distance to use',
+                          choices=sorted(builtin_distances.keys()))
+    p_assign.add_argument('--index',
+                          help='how to find nearest group members '
+                               '(default: bktree for metric distances, '
+                               'otherwise scan)',
+                          choices=sorted(indexes.keys()))
+    p_assign.set_defaults(func=self.assign_)
+
+    p_serve = subparsers.add_parser('serve',
+                                    parents=[p_blender],
+                                    help='calculate all partitions of data '
+                                         'and answer requests for them '
+                                         'over HTTP')
+    p_serve.add_argument('infile',
+                         nargs='?',
+                         help='lines of text to calculate groups for',
+                         type=argparse.FileType('r'),
+                         default=sys.stdin)
+    p_serve.add_argument('--host',
+                         help='address to listen on (default: 127.0.0.1)',
+                         default='127.0.0.1')
+    p_serve.add_argument('--port',
+                         help='port to listen on (default: 8000)',
+                         type=int,
+                         default=8000)
+    p_serve.add_argument('--quiet',
+                         help='don\'t log each request to standard error',
+                         action='store_true')
+    p_serve.set_defaults(func=self.serve)
+
+    p_table_help = 'make a merge table from a partition'
     p_table = subparsers.add_parser('table', help=p_table_help)
     p_table.add_argument('partition',
                          nargs='?',
-                         help='a JSON partition file',
-                         type=argparse.FileType('r'),
+                         help='a JSON or binary partition file',
+                         type=argparse.FileType('rb'),
                          default=sys.stdin)
     p_table.set_defaults(func=table_)
 
+    p_join = subparsers.add_parser('join',
+                                   help='add a mergic key column to CSV '
+                                        'data')
+    p_join.add_argument('partition',
+                        help='a JSON or binary partition file',
+                        type=argparse.FileType('rb'))
+    p_join.add_argument('data',
+                        nargs='?',
+                        help='a CSV file with a header row',
+                        type=argparse.FileType('rb'),
+                        default=sys.stdin)
+    p_join.add_argument('--column',
+                        help='the column of original values to look up',
+                        required=True)
+    p_join.set_defaults(func=join_)
+
+    p_pack = subparsers.add_parser('pack',
+                                   help='convert a partition to binary')
+    p_pack.add_argument('partition',
+                        nargs='?',
+                        help='a JSON or binary partition file',
+                        type=argparse.FileType('rb'),
+                        default=sys.stdin)
+    p_pack.set_defaults(func=pack_)
+
+    p_unpack = subparsers.add_parser('unpack',
+                                     help='convert a partition to JSON')
+    p_unpack.add_argument('partition',
+                          nargs='?',
+                          help='a JSON or binary partition file',
+                          type=argparse.FileType('rb'),
+                          default=sys.stdin)
+    p_unpack.set_defaults(func=unpack_)
+
     args = parser.parse_args()
+    if args.command == 'make':
+        if (args.cutoff is None and args.cutoffs is None and
+                args.infile is not None):
+            try:
+                args.infile, args.cutoff = None, float(args.infile)
+            except ValueError:
+                pass
+        try:
+            args.infile = argparse.FileType('r')(args.infile or '-')
+        except argparse.ArgumentTypeError as e:
+            p_make.error(str(e))
+        if (args.cutoff is None) == (args.cutoffs is None):
+            p_make.error('give either a cutoff or --cutoffs')
+        if (args.cutoffs is None) != (args.outdir is None):
+            p_make.error('--cutoffs and --outdir go together')
+    if getattr(args, 'block', None) is not None:
+        self.blocker = blockers[args.block]
+    if getattr(args, 'block_field', None) is not None:
+        if getattr(args, 'block', None) is not None:
+            parser.error('give either --block or --block-field')
+        self.blocker = field_blocker(args.block_field)
+    if getattr(args, 'field', None) is not None:
+        self.distance = RecordDistance(
+            [(column, distance or args.distance or 'stock', weight)
+             for column, distance, weight in args.field])
+    elif getattr(args, 'distance', None) is not None:
+        distance = builtin_distances[args.distance]()
+        if isinstance(self.distance, PreprocessedDistance):
+            self.distance.distance = distance
+            self.distance.symmetric = distance.symmetric
+            self.distance.metric = distance.metric
+            self.distance.depends_on_items = distance.depends_on_items
+        else:
+            self.distance = distance
+    if getattr(args, 'jobs', None) is not None:
+        self.workers = args.jobs
+    if getattr(args, 'cache_dir', None) is not None:
+        self.cache_dir = args.cache_dir
+    if getattr(args, 'engine', None) is not None:
+        self.engine = args.engine
+    if getattr(args, 'memory_budget', None) is not None:
+        self.memory_budget = int(args.memory_budget * 2 ** 20)
+    if getattr(args, 'stats', False) and self.stats is None:
+        self.stats = Stats()
     args.func(args)
+    if getattr(args, 'stats', False):
+        self.stats.phase(None)
+        sys.stderr.write(pretty_json(self.stats.report()) + '\n')
 
 
 class Blender(object):
@@ -402,28 +3910,50 @@ class Blender(object):
     links_at : dict
         Numeric keys representing distances point to lists containing
         length two tuples where each tuple is a pair of elements
-        separated by the corresponding distance.
+        separated by the corresponding distance. With the 'mst' engine
+        only the pairs linked by the minimum spanning tree are kept.
 
     ordered_items : list
         All the original items in the order induced by grouping them
         agglomeratively. Used for ordering other groupings.
 
+    position : dict
+        The index of each item in `ordered_items`, for sorting by it.
+
     cutoffs : list
-        A sorted list of cutoffs (keys from `links_at`), exposed
-        separately for convenience.
+        A sorted list of cutoffs (all the distinct distances found),
+        exposed separately for convenience.
+
+    merges : list
+        The merge dendrogram: tuples of a distance and a pair of items,
+        for each link that merged two groups, in the order the merges
+        happen. Cutting it at a cutoff gives the partition there.
+
+    steps : list
+        Every row of the summary, for each cutoff until everything is
+        in one group. See `summary`.
 
     """
 
-    def __init__(self, distance='stock', key_method='longest'):
+    def __init__(self, distance='stock', key_method='longest',
+                 blocker=None, workers=None, engine='pairs',
+                 cache_dir='.mergic', cache_size=8,
+                 preprocess=None, memo=False, max_distance=None,
+                 stats=None, memory_budget=None):
         """Create a new mergic Blender.
 
         Parameters
         ----------
-        distance : function or 'stock' (default='stock')
+        distance : function, Distance, or name (default='stock')
             A function of two variables which returns a distance.
             Larger return values indicate greater distance.
             The default ('stock') becomes a string distance using
             only the base Python SequenceMatcher.
+            The names 'levenshtein', 'jaro_winkler', 'ngram_jaccard',
+            'tfidf_cosine' and 'exact' give other built-in distances.
+            Built-in distances are `Distance` objects, which calculate
+            whole rows of distances at a time; `calc` uses rows
+            whenever it can.
 
         key_method : function, 'longest', or 'append' (default='longest')
             A function of a list that returns a string to use as the
@@ -433,9 +3963,99 @@ class Blender(object):
             The 'append' method concatenates all the elements of the
             list, in sorted order.
 
+        blocker : function, 'ngram', 'neighborhood', or None (default=None)
+            A function of a list of unique items that returns a set of
+            candidate pairs (i, j) of indices into the list, with i < j.
+            Distances are only calculated for candidate pairs. The
+            default (None) calculates distances for all pairs.
+            The 'ngram' blocker pairs items that share a character
+            trigram. The 'neighborhood' blocker pairs items within ten
+            places of one another in sorted order.
+            Groupings are the same as without blocking as long as the
+            blocker finds every pair within the cutoffs of interest.
+            A blocker whose pairs depend on the other items, like the
+            'neighborhood' blocker, should have a true `depends_on_items`
+            attribute, so that updates calculate everything again.
+            A blocker can also have a `columns` attribute that finds
+            its pairs a column at a time, as `ngram_columns` does, for
+            `memory_budget` to use.
+
+        workers : int or None (default=None)
+            The number of processes to calculate distances with. With
+            more than one, pairs are split into chunks that are sent to
+            a pool of worker processes. Results are the same either way,
+            but the distance function should not depend on state that
+            changes while distances are calculated.
+
+        engine : 'pairs' or 'mst' (default='pairs')
+            The 'pairs' engine keeps a link for every pair of items,
+            which takes memory proportional to the number of pairs.
+            The 'mst' engine keeps only the links of a minimum spanning
+            tree, which is all that grouping needs, so memory grows
+            with the number of items (and distinct distances) instead.
+            Both give the same summaries and partitions. The 'mst'
+            engine compares all pairs, calculating distances in this
+            process, so it ignores `blocker` and `workers`.
+
+        cache_dir : str or None (default='.mergic')
+            A directory to cache the results of `calc` in, so that
+            later runs on the same input are fast. Entries are keyed
+            by a hash of the input lines and descriptions of the
+            distance function and blocker, so changing any of them
+            misses the cache. None turns off caching.
+
+        cache_size : int (default=8)
+            The number of cache entries to keep. The least recently
+            used entries are removed first.
+
+        preprocess : function or None (default=None)
+            A function of an item that returns the form of it that the
+            distance is calculated on, for example a normalized name.
+            Each item is only preprocessed once.
+
+        memo : boolean (default=False)
+            If True, remember the distance between every pair of
+            preprocessed forms that is calculated, so that items with
+            the same form are only compared once. This saves distance
+            calculations when many items share forms, at the cost of
+            memory for every distinct pair of forms.
+
+        max_distance : number or None (default=None)
+            If given, `calc` only finds distances up to `max_distance`,
+            letting distances skip or abandon pairs that are further
+            apart, and only makes partitions at cutoffs up to it. The
+            partitions are the same as without it, though groups of
+            the same size may be listed in another order. Bounded
+            calculations use the 'pairs' engine and aren't cached.
+
+        stats : Stats or None (default=None)
+            If given, timings of each phase of work, counts of distance
+            calls and their times, and cache hits and misses are kept
+            in `stats` as the Blender works. See `Stats.report`.
+
+        memory_budget : int or None (default=None)
+            If given, the 'pairs' engine keeps links in memory only
+            until they would take about this many bytes, then sorts
+            them and writes them to a temporary file. The sorted files
+            are merged back in order to find the links that merge
+            groups. The results are the same as without a budget, but
+            the pairs no longer need to fit in memory. The distinct
+            distances are still all kept. Candidate pairs from a
+            blocker are found a column at a time if it has a `columns`
+            attribute, as the built-in blockers do; the pairs of other
+            blockers are all held in memory, outside the budget.
+            Temporary files go where Python's `tempfile` puts them
+            (set by TMPDIR).
+
         """
-        if distance == 'stock':
-            distance = lambda a, b: 1 - SequenceMatcher(None, a, b).ratio()
+        if isinstance(distance, basestring):
+            if distance not in builtin_distances:
+                raise ValueError('No distance named {}'.format(distance))
+            distance = builtin_distances[distance]()
+        elif not isinstance(distance, Distance):
+            distance = FunctionDistance(distance)
+        if preprocess is not None:
+            distance = PreprocessedDistance(distance, preprocess, memo)
         self.distance = distance
 
         if key_method == 'longest':
@@ -444,12 +4064,46 @@ class Blender(object):
             key_method = lambda x: "|".join(sorted(x))
         self.key_method = key_method
 
+        if blocker in blockers:
+            blocker = blockers[blocker]
+        self.blocker = blocker
+
+        self.workers = workers
+
+        self.engine = engine
+
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+
+        self.max_distance = max_distance
+
+        self.stats = stats
+
+        self.memory_budget = memory_budget
+
         self.links_at = None
         self.ordered_items = None
+        self.position = None
         self.cutoffs = None
+        self.merges = None
+        self.steps = None
 
+    row = _row
+    distances = _distances
+    links = _links
+    spilled_links = _spilled_links
+    spanning_tree = _spanning_tree
+    fit = _fit
+    summary = _summary
+    signals = _signals
+    suggest = _suggest
+    partition = _partition
     calc = _calc_
+    partitions = _partitions
     make = _make_
+    assign = _assign
+    assign_ = _assign_
+    serve = _serve_
     script = _script
 
 
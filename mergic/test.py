@@ -1,5 +1,16 @@
 import mergic
+import functools
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+import urllib2
+from collections import OrderedDict
 
 
 class TestPrettyJson(unittest.TestCase):
@@ -9,6 +20,70 @@ class TestPrettyJson(unittest.TestCase):
         self.assertEqual(mergic.pretty_json({1: [1, 2]}), expected)
 
 
+class TestReadGroups(unittest.TestCase):
+
+    def read(self, text, size=2):
+        return list(mergic.read_groups(io.BytesIO(text), size))
+
+    def test_reads_groups_in_order(self):
+        text = '{"b": [1, 2], "a": ["x"]}'
+        self.assertEqual(self.read(text), [('b', [1, 2]), ('a', ['x'])])
+
+    def test_reads_empty_partition(self):
+        self.assertEqual(self.read(' {\n} '), [])
+
+    def test_numbers_arent_cut_between_reads(self):
+        self.assertEqual(self.read('{"a": 12345}', size=8), [('a', 12345)])
+
+    def test_raises_on_non_object(self):
+        with self.assertRaises(ValueError):
+            self.read('[1, 2]')
+
+    def test_raises_on_truncated_file(self):
+        with self.assertRaises(ValueError):
+            self.read('{"a": [1, 2')
+
+
+class TestWriteGroups(unittest.TestCase):
+
+    def test_writes_same_as_pretty_json(self):
+        for partition in [{}, {'a': []}, {'a': [1, 2], 'b': ['x']}]:
+            out = io.BytesIO()
+            mergic.write_groups(partition.items(), out)
+            self.assertEqual(out.getvalue(),
+                             mergic.pretty_json(partition) + '\n')
+
+
+class TestBinaryPartition(unittest.TestCase):
+
+    def round_trip(self, groups):
+        out = io.BytesIO()
+        mergic.write_binary(groups, out)
+        return list(mergic.read_partition(io.BytesIO(out.getvalue())))
+
+    def test_round_trip_keeps_groups_in_order(self):
+        groups = [(u'b', [u'x', u'y\xe9']), (u'a', []), (u'', [u'z'])]
+        self.assertEqual(self.round_trip(groups), groups)
+
+    def test_round_trip_of_nothing(self):
+        self.assertEqual(self.round_trip([]), [])
+
+    def test_raises_on_non_string(self):
+        with self.assertRaises(ValueError):
+            mergic.write_binary([(u'a', [1])], io.BytesIO())
+
+    def test_reads_json_too(self):
+        groups = mergic.read_partition(io.BytesIO('{"a": ["b"]}'))
+        self.assertEqual(list(groups), [(u'a', [u'b'])])
+
+    def test_reads_utf8_without_decoding(self):
+        out = io.BytesIO()
+        mergic.write_binary([(u'\xe9', [u'e', u'\xe9'])], out)
+        groups = mergic.read_partition(io.BytesIO(out.getvalue()),
+                                       decode=False)
+        self.assertEqual(list(groups), [('\xc3\xa9', ['e', '\xc3\xa9'])])
+
+
 class TestCheck(unittest.TestCase):
 
     def test_raises_on_duplicate_in_value_list(self):
@@ -19,10 +94,24 @@ class TestCheck(unittest.TestCase):
         with self.assertRaises(ValueError):
             mergic.check({1: [1], 2: [1]})
 
+    def test_raises_on_repeated_key(self):
+        with self.assertRaises(ValueError):
+            list(mergic.checked([(1, [1]), (1, [2])]))
+
     def test_returns_number_of_values(self):
         partition = {1: [1], 2: [2, 3], 3: [4]}
         self.assertEqual(mergic.check(partition), 4)
 
+    def test_counts_items_and_groups(self):
+        f = io.BytesIO('{"a": ["a", "b"], "c": ["c"]}')
+        self.assertEqual(mergic.count_groups(f), (3, 2))
+
+    def test_manifest_paths_are_relative_to_it(self):
+        f = io.BytesIO('# audit\na.json\n\n/tmp/b.json\n')
+        f.name = os.path.join('audit', 'manifest.txt')
+        self.assertEqual(list(mergic.read_manifest(f)),
+                         [os.path.join('audit', 'a.json'), '/tmp/b.json'])
+
 
 class TestLinkItems(unittest.TestCase):
 
@@ -43,6 +132,839 @@ class TestLinkItems(unittest.TestCase):
         self.assertEqual(set(group_of[1]), set((1, 2)))
 
 
+class TestGrouping(unittest.TestCase):
+
+    def test_starts_with_a_group_per_item(self):
+        grouping = mergic.Grouping([1, 2, 2, 3])
+        self.assertEqual(len(grouping), 3)
+
+    def test_union_merges_once(self):
+        grouping = mergic.Grouping([1, 2])
+        self.assertTrue(grouping.union(1, 2))
+        self.assertFalse(grouping.union(2, 1))
+        self.assertEqual(grouping.find(1), grouping.find(2))
+
+    def test_members_keep_concatenation_order(self):
+        grouping = mergic.Grouping([1, 2, 3, 4])
+        mergic.link_items(grouping, [(3, 4), (2, 1), (2, 3)])
+        self.assertEqual(grouping.members(4), (2, 1, 3, 4))
+
+    def test_keeps_summary_statistics(self):
+        grouping = mergic.Grouping(range(6))
+        mergic.link_items(grouping, [(0, 1), (2, 3), (1, 2), (4, 5)])
+        self.assertEqual(len(grouping), 2)
+        self.assertEqual(grouping.max_size, 4)
+        self.assertEqual(grouping.num_pairs, 7)
+
+    def test_order_matches_tuple_link_items(self):
+        links = [(1, 2), (4, 3), (5, 1), (3, 5), (6, 7)]
+        group_of = {item: (item,) for item in range(1, 8)}
+        mergic.link_items(group_of, links)
+        grouping = mergic.Grouping(range(1, 8))
+        mergic.link_items(grouping, links)
+        self.assertEqual(set(grouping.groups()), set(group_of.values()))
+
+
+class TestOrderGroups(unittest.TestCase):
+
+    def test_concatenates_groups_by_first_appearance(self):
+        groups = [('c',), ('b', 'a'), ('d',)]
+        self.assertEqual(mergic.order_groups(groups, ['a', 'b', 'c', 'd']),
+                         ('b', 'a', 'c', 'd'))
+
+
+class TestReportCutoffs(unittest.TestCase):
+
+    def test_reports_everything_by_default(self):
+        self.assertEqual(mergic.report_cutoffs([1, 2, 3]), set([0, 1, 2]))
+
+    def test_reports_largest_in_each_step(self):
+        cutoffs = [0.05, 0.08, 0.15, 0.31, 0.32]
+        self.assertEqual(mergic.report_cutoffs(cutoffs, step=0.1),
+                         set([1, 2, 4]))
+
+    def test_reports_quantiles(self):
+        cutoffs = range(9)
+        self.assertEqual(mergic.report_cutoffs(cutoffs, quantiles=4),
+                         set([2, 4, 6, 8]))
+
+    def test_raises_on_bad_step_or_quantiles(self):
+        with self.assertRaises(ValueError):
+            mergic.report_cutoffs([1, 2], step=0)
+        with self.assertRaises(ValueError):
+            mergic.report_cutoffs([1, 2], quantiles=-1)
+
+
+class TestBlockers(unittest.TestCase):
+
+    def test_ngram_pairs_items_sharing_a_gram(self):
+        items = ['abcd', 'xbcd', 'wxyz']
+        self.assertEqual(mergic.ngram_blocker(items), set([(0, 1)]))
+
+    def test_neighborhood_pairs_sorted_neighbors(self):
+        items = ['c', 'a', 'b']
+        pairs = mergic.neighborhood_blocker(items, window=2)
+        self.assertEqual(pairs, set([(1, 2), (0, 2)]))
+
+    def test_key_blocker_pairs_same_key(self):
+        blocker = mergic.key_blocker(len)
+        self.assertEqual(blocker(['a', 'bb', 'c']), set([(0, 2)]))
+
+    def test_field_blocker_pairs_records_agreeing_on_any_field(self):
+        blocker = mergic.field_blocker([0, 2])
+        records = ['ANNA,,MEIER', 'ANNA,,MAIER', ',,MEIER', ',,BAUER']
+        self.assertEqual(blocker(records), set([(0, 1), (0, 2)]))
+
+    def test_columns_find_the_same_pairs(self):
+        items = ['ANNA,,MEIER', 'ANNA,,MAIER', ',,MEIER', ',,BAUER',
+                 'ANN,,BAUER', 'ANNA,,MEIER2', 'OTTO,,MEIER']
+        for blocker in [mergic.ngram_blocker, mergic.neighborhood_blocker,
+                        mergic.key_blocker(len),
+                        mergic.field_blocker([0, 2])]:
+            pairs = set((i, j) for j, ids in blocker.columns(items)
+                        for i in ids)
+            self.assertEqual(pairs, blocker(items))
+
+    def test_neighborhood_columns_with_window(self):
+        items = ['c', 'a', 'b', 'd']
+        self.assertEqual(list(mergic.neighborhood_columns(items, window=2)),
+                         [(2, [0, 1]), (3, [0])])
+
+
+class TestCandidatePairs(unittest.TestCase):
+
+    def test_all_pairs_without_blocker(self):
+        items = ['a', 'b', 'c']
+        self.assertEqual(list(mergic.candidate_pairs(items)),
+                         [('a', 'b'), ('a', 'c'), ('b', 'c')])
+
+    def test_duplicates_pair_with_themselves_once(self):
+        items = ['a', 'b', 'a', 'a']
+        self.assertEqual(list(mergic.candidate_pairs(items)),
+                         [('a', 'a'), ('a', 'b'), ('b', 'a')])
+
+    def test_blocker_keeps_combinations_order(self):
+        items = ['a', 'b', 'c', 'b']
+        blocker = lambda unique: set([(1, 2), (0, 1)])
+        self.assertEqual(list(mergic.candidate_pairs(items, blocker)),
+                         [('b', 'b'), ('a', 'b'), ('b', 'c'), ('c', 'b')])
+
+    def test_columns_of_repeated_items_hold_the_same_pairs(self):
+        items = ['ab', 'abc', 'b', 'ab', 'bcd', 'a', 'abc', 'ab', 'b', 'ab']
+        columns = {}
+        for p, q in mergic.candidate_positions(items):
+            columns.setdefault(q, []).append(p)
+        self.assertEqual(list(mergic.candidate_columns(items)),
+                         sorted(columns.items()))
+
+    def test_columns_from_start_of_repeated_items(self):
+        items = ['ab', 'abc', 'b', 'ab', 'bcd', 'a', 'abc', 'ab', 'b', 'ab']
+        columns = list(mergic.candidate_columns(items))
+        for start in range(len(items) + 1):
+            self.assertEqual(list(mergic.candidate_columns(items, None,
+                                                           start)),
+                             [(q, ps) for q, ps in columns if q >= start])
+
+    def test_streamed_columns_find_the_same_pairs(self):
+        items = ['ab', 'abc', 'b', 'ab', 'bcd', 'a', 'abc', 'bc', 'b']
+        blocker = mergic.ngram_blocker
+        for start in [0, 4]:
+            pairs = [(p, q) for p, q in mergic.candidate_positions(items,
+                                                                   blocker)
+                     if q >= start]
+            streamed = [(p, q) for q, ps in mergic.streamed_columns(
+                items, blocker, start) for p in ps]
+            self.assertEqual(sorted(streamed), sorted(pairs))
+
+
+class TestDistances(unittest.TestCase):
+
+    def test_workers_give_same_results_in_same_order(self):
+        items = ['apple', 'apply', 'ample', 'maple', 'staple']
+        columns = list(mergic.candidate_columns(items))
+        serial = list(mergic.Blender().distances(items, columns))
+        parallel = mergic.Blender(workers=2).distances(items, columns)
+        self.assertEqual(serial, list(parallel))
+
+    def test_workers_with_unpicklable_distance(self):
+        items = ['apple', 'apply', 'ample', 'maple', 'staple']
+        columns = list(mergic.candidate_columns(items))
+        distance = lambda a, b: abs(len(a) - len(b))
+        serial = list(mergic.Blender(distance).distances(items, columns))
+        parallel = mergic.Blender(distance, workers=2).distances(items,
+                                                                 columns)
+        self.assertEqual(serial, list(parallel))
+
+    def test_one_process_when_distance_cant_be_sent(self):
+        items = ['apple', 'apply', 'ample']
+        columns = list(mergic.candidate_columns(items))
+        distance = lambda a, b: abs(len(a) - len(b))
+        fork = os.fork
+        del os.fork
+        try:
+            self.assertFalse(mergic.can_send(mergic.FunctionDistance(
+                distance)))
+            self.assertTrue(mergic.can_send(mergic.LevenshteinDistance()))
+            rows = mergic.Blender(distance, workers=2).distances(items,
+                                                                 columns)
+            self.assertEqual([row for _, _, row in rows], [[0], [0, 0]])
+        finally:
+            os.fork = fork
+
+    def test_rows_match_pairs(self):
+        items = ['', 'a', 'kitten', 'sitting', 'Saturday', 'Sunday',
+                 'abcdefghij' * 8, 'bcdefghija' * 8]
+        for name in sorted(mergic.builtin_distances):
+            distance = mergic.builtin_distances[name]()
+            distance.fit(items)
+            for item in items:
+                row = distance.row(item, items)
+                pairs = [distance(other, item) for other in items]
+                for x, y in zip(row, pairs):
+                    self.assertAlmostEqual(x, y, msg=name)
+
+    def test_bounded_rows_match_rows(self):
+        items = ['', 'a', 'kitten', 'sitting', 'Saturday', 'Sunday',
+                 'abcdefghij' * 8, 'bcdefghija' * 8]
+        for name in sorted(mergic.builtin_distances):
+            distance = mergic.builtin_distances[name]()
+            distance.fit(items)
+            for bound in [0, 0.3, 1, 3]:
+                for item in items:
+                    row = distance.row(item, items)
+                    bounded = distance.bounded_row(item, items, bound)
+                    self.assertEqual(bounded, [d if d <= bound else None
+                                               for d in row], msg=name)
+
+    def test_bounded_levenshtein_abandons_far_pairs(self):
+        distance = mergic.LevenshteinDistance()
+        self.assertEqual(distance.bounded_row('abc', ['abd', 'xyz'], 1),
+                         [1, None])
+
+    def test_levenshtein(self):
+        distance = mergic.LevenshteinDistance()
+        self.assertEqual(distance('kitten', 'sitting'), 3)
+        self.assertEqual(distance('Saturday', 'Sunday'), 3)
+        self.assertEqual(distance('', 'abc'), 3)
+        self.assertEqual(distance('x' * 70, 'y' + 'x' * 70), 1)
+
+    def test_jaro_winkler_row_with_repeated_characters(self):
+        distance = mergic.JaroWinklerDistance()
+        row = distance.row('ababa', ['abaab', 'babba', 'aaaab'])
+        for x, y in zip(row, [0.0467, 0.2167, 0.195]):
+            self.assertAlmostEqual(x, y, 4)
+
+    def test_jaro_winkler(self):
+        distance = mergic.JaroWinklerDistance()
+        self.assertAlmostEqual(distance('MARTHA', 'MARHTA'), 1 - 0.9611, 4)
+        self.assertAlmostEqual(distance('DIXON', 'DICKSONX'), 1 - 0.8133, 4)
+
+    def test_preprocess_once_and_compare_forms_once(self):
+        seen = []
+        compared = []
+
+        def preprocess(item):
+            seen.append(item)
+            return item.lower()
+
+        def distance(one, other):
+            compared.append((one, other))
+            return 0 if one == other else 1
+
+        blender = mergic.Blender(distance, preprocess=preprocess, memo=True)
+        blender.distance.fit(['A', 'a', 'B'])
+        self.assertEqual(blender.distance.row('B', ['A', 'a']), [1, 1])
+        self.assertEqual(blender.distance.row('b', ['a', 'A']), [1, 1])
+        self.assertEqual(sorted(seen), ['A', 'B', 'a', 'b'])
+        self.assertEqual(compared, [('a', 'b')])
+
+    def test_record_distance_weights_fields(self):
+        distance = mergic.RecordDistance([(0, 'levenshtein', 1),
+                                          (2, 'exact', 10)])
+        records = ['ANNA,x,1949', 'ANNE,y,1949', 'ANNA,x,1950']
+        distance.fit(records)
+        self.assertEqual(distance.row(records[0], records), [0, 1, 10])
+        self.assertEqual(distance('"ANNA",z,1950', records[1]), 11)
+        self.assertEqual(distance.bounded_row(records[0], records, 5),
+                         [0, 1, None])
+
+    def test_record_distance_compares_each_field_value_once(self):
+        compared = []
+
+        def distance(one, other):
+            compared.append((one, other))
+            return 0 if one == other else 1
+
+        distance_ = mergic.RecordDistance([(0, distance, 1)])
+        records = ['a,1', 'a,2', 'b,3', 'b,4']
+        distance_.fit(records)
+        self.assertEqual(distance_.row('a,5', records), [0, 0, 1, 1])
+        self.assertEqual(compared, [('a', 'a'), ('b', 'a')])
+
+    def test_same_items_are_zero_apart(self):
+        for name in sorted(mergic.builtin_distances):
+            distance = mergic.builtin_distances[name]()
+            distance.fit(['same', 'other'])
+            self.assertAlmostEqual(distance('same', 'same'), 0, msg=name)
+
+
+class TestSpanningTree(unittest.TestCase):
+
+    def setUp(self):
+        self.items = ['apple', 'apply', 'ample', 'maple', 'apple', 'pear']
+        self.blender = mergic.Blender()
+
+    def test_keeps_one_link_fewer_than_unique_items(self):
+        links_at, distances = self.blender.spanning_tree(self.items)
+        self.assertEqual(sum(len(x) for x in links_at.values()), 4)
+
+    def test_nothing_for_no_items(self):
+        self.assertEqual(self.blender.spanning_tree([]), ({}, set()))
+
+    def test_finds_all_distinct_distances(self):
+        links_at, distances = self.blender.spanning_tree(self.items)
+        pairs = mergic.candidate_pairs(self.items)
+        expected = set(self.blender.distance(*pair) for pair in pairs)
+        self.assertEqual(distances, expected)
+
+
+class TestPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.blender = mergic.Blender()
+        self.blender.ordered_items = ('a', 'b', 'c', 'd')
+        self.blender.position = {'a': 0, 'b': 1, 'c': 2, 'd': 3}
+        self.blender.merges = [(1, 'a', 'b'), (2, 'c', 'd'), (3, 'b', 'c')]
+
+    def test_cuts_dendrogram_at_each_cutoff(self):
+        results = dict(self.blender.partitions([0, 2, 3]))
+        self.assertEqual(len(results[0]), 4)
+        self.assertEqual(results[2].values(), [['a', 'b'], ['c', 'd']])
+        self.assertEqual(results[3].values(), [['a', 'b', 'c', 'd']])
+
+    def test_raises_past_max_distance(self):
+        self.blender.max_distance = 2
+        with self.assertRaises(ValueError):
+            list(self.blender.partitions([1, 3]))
+
+    def test_yields_cutoffs_in_sorted_order(self):
+        cutoffs = [cutoff for cutoff, _ in self.blender.partitions([2, 1])]
+        self.assertEqual(cutoffs, [1, 2])
+
+
+class TestTruePairs(unittest.TestCase):
+
+    def test_partition_pairs(self):
+        partition = mergic.partition_pairs([('a', 'b'), ('c', 'd'),
+                                            ('b', 'e')])
+        self.assertTrue(mergic.equal(partition, {'a': ['a', 'b', 'e'],
+                                                 'c': ['c', 'd']}))
+
+    def test_counts_true_pairs_after_each_merge(self):
+        merges = [(1, 'a', 'b'), (2, 'c', 'd'), (3, 'a', 'c')]
+        truth = {'x': ['a', 'b', 'c'], 'y': ['e', 'f']}
+        total, found = mergic.true_pairs(['a', 'b', 'c', 'd', 'e'],
+                                         merges, truth)
+        self.assertEqual(total, 3)
+        self.assertEqual(found, [1, 1, 3])
+
+
+class TestRuns(unittest.TestCase):
+
+    def test_round_trip_keeps_links_in_order(self):
+        links = [(0.5 * (i % 7), i, i + 1) for i in range(10000)]
+        f = tempfile.TemporaryFile()
+        mergic.write_run(links, f)
+        self.assertEqual(list(mergic.read_run(f)), links)
+        f.close()
+
+
+class TestStats(unittest.TestCase):
+
+    def test_phases_add_up(self):
+        stats = mergic.Stats()
+        for name in ['read', 'calc', 'read', None]:
+            stats.phase(name)
+        self.assertEqual(stats.phases.keys(), ['read', 'calc'])
+        self.assertIsNone(stats.current)
+
+    def test_latencies_round_up_to_powers_of_two(self):
+        stats = mergic.Stats()
+        stats.time_calls(10, 0.00003)
+        stats.time_calls(1, 0.0000001)
+        stats.time_calls(0, 1)
+        self.assertEqual(stats.latencies, {4: 10, 1: 1})
+        self.assertEqual(stats.counts['distance_calls'], 11)
+
+    def test_report_is_json(self):
+        stats = mergic.Stats()
+        stats.phase('read')
+        stats.count('cache_hits')
+        report = json.loads(json.dumps(stats.report()))
+        self.assertEqual(report['counts'], {'cache_hits': 1})
+        self.assertIn('read', report['phases'])
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.cache_dir, 'a' * 40)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_key_depends_on_distance(self):
+        one = mergic.describe(lambda a, b: 1)
+        other = mergic.describe(lambda a, b: 2)
+        self.assertNotEqual(mergic.cache_key(['a'], one),
+                            mergic.cache_key(['a'], other))
+
+    def test_key_depends_on_bound_method(self):
+        class Distances(object):
+            def near(self, a, b):
+                return 0
+
+            def far(self, a, b):
+                return 1
+        distances = Distances()
+        self.assertNotEqual(mergic.describe(distances.near),
+                            mergic.describe(distances.far))
+
+    def test_key_depends_on_partial_arguments(self):
+        one = functools.partial(mergic.grams, n=2)
+        other = functools.partial(mergic.grams, n=3)
+        self.assertNotEqual(mergic.describe(one), mergic.describe(other))
+
+    def test_key_depends_on_distance_parameters(self):
+        class Scaled(mergic.Distance):
+            def __init__(self, scale):
+                self.scale = scale
+
+            def distance(self, a, b):
+                return self.scale * (a != b)
+        self.assertNotEqual(mergic.describe(Scaled(1)),
+                            mergic.describe(Scaled(2)))
+
+    def test_describes_methods_of_builtin_types(self):
+        self.assertNotEqual(mergic.describe(str.lower),
+                            mergic.describe(str.upper))
+
+    def test_cant_describe_objects_referring_to_themselves(self):
+        loop = []
+        loop.append(loop)
+        with self.assertRaises(ValueError):
+            mergic.describe(loop)
+
+    def test_cant_describe_opaque_objects(self):
+        with self.assertRaises(ValueError):
+            mergic.describe(open(os.devnull))
+
+    def test_key_depends_on_items(self):
+        self.assertNotEqual(mergic.cache_key(['a', 'b']),
+                            mergic.cache_key(['a', 'c']))
+
+    def test_round_trip_keeps_int_distances(self):
+        merges = [(0, 'b', 'a'), (2, 'a', 'c')]
+        mergic.write_cache(self.path, ['b', 'a', 'c'], merges, [0, 1, 2])
+        cached = mergic.read_cache(self.path)
+        self.assertEqual(cached, (['b', 'a', 'c'], merges, [0, 1, 2]))
+        self.assertIs(type(cached[2][0]), int)
+
+    def test_round_trip_keeps_float_distances(self):
+        merges = [(0.1, 'b', 'a')]
+        mergic.write_cache(self.path, ['b', 'a'], merges, [0.1, 0.7])
+        cached = mergic.read_cache(self.path)
+        self.assertEqual(cached, (['b', 'a'], merges, [0.1, 0.7]))
+
+    def test_round_trip_keeps_unicode_items(self):
+        merges = [(1, u'Jos\xe9', u'Jose')]
+        mergic.write_cache(self.path, [u'Jos\xe9', u'Jose'], merges, [1],
+                           2, 'utf-8')
+        cached = mergic.read_cache(self.path)
+        self.assertEqual(cached, ([u'Jos\xe9', u'Jose'], merges, [1]))
+        self.assertIs(type(cached[0][1]), unicode)
+
+    def test_lines_of_strings(self):
+        self.assertEqual(mergic.cache_lines(['a', 'b']), (['a', 'b'], None))
+        self.assertEqual(mergic.cache_lines([u'Jos\xe9']),
+                         (['Jos\xc3\xa9'], 'utf-8'))
+
+    def test_no_lines_for_other_items(self):
+        self.assertIsNone(mergic.cache_lines([1, 2]))
+        self.assertIsNone(mergic.cache_lines(['a', u'b']))
+        self.assertIsNone(mergic.cache_lines(['a\nb']))
+
+    def test_doesnt_write_mixed_int_and_float_distances(self):
+        merges = [(0, 'b', 'a'), (0.5, 'a', 'c')]
+        self.assertFalse(mergic.write_cache(self.path, ['b', 'a', 'c'],
+                                            merges, [0, 0.5]))
+        self.assertIsNone(mergic.read_cache(self.path))
+
+    def test_missing_entry_reads_as_none(self):
+        self.assertIsNone(mergic.read_cache(self.path))
+
+    def test_evicts_least_recently_used(self):
+        for name in 'abc':
+            path = os.path.join(self.cache_dir, name * 40)
+            mergic.write_cache(path, ['x'], [], [])
+            os.utime(path, (ord(name), ord(name)))
+        mergic.evict_cache(self.cache_dir, 2)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         ['b' * 40, 'c' * 40])
+
+    def test_finds_longest_cached_prefix(self):
+        items = ['a', 'b', 'c', 'd']
+        for k in (1, 2, 4):
+            path = os.path.join(self.cache_dir, mergic.cache_key(items[:k]))
+            mergic.write_cache(path, items[:k], [], [], k)
+        self.assertEqual(mergic.find_prefix(self.cache_dir, items[:3]),
+                         (2, os.path.join(self.cache_dir,
+                                          mergic.cache_key(items[:2]))))
+
+    def test_ignores_prefix_with_other_parts(self):
+        path = os.path.join(self.cache_dir, mergic.cache_key(['a'], 'x'))
+        mergic.write_cache(path, ['a'], [], [], 1)
+        self.assertIsNone(mergic.find_prefix(self.cache_dir, ['a', 'b'], 'y'))
+
+
+calls = []
+
+
+def length_distance(a, b):
+    calls.append((a, b))
+    return abs(len(a) - len(b)) + (a[0] != b[0])
+
+
+class TestFit(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        # A function rather than a method, so that the calls it logs
+        # aren't part of its cache key.
+        self.distance = length_distance
+        self.calls = calls
+        del calls[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def fit(self, items, update=False):
+        blender = mergic.Blender(self.distance, cache_dir=self.cache_dir)
+        return blender.fit(items, update=update)
+
+    def test_summary_and_partition(self):
+        blender = self.fit(['a', 'bb', 'b', 'ccc'])
+        self.assertEqual(blender.summary(), [(4, 1, 0, 0),
+                                             (2, 3, 3, 1),
+                                             (1, 4, 6, 2)])
+        self.assertEqual(blender.summary(quantiles=1), [(4, 1, 0, 0),
+                                                        (1, 4, 6, 2)])
+        self.assertEqual(blender.partition(1),
+                         {'bb': ['bb', 'a', 'b'], 'ccc': ['ccc']})
+
+    def test_signals_and_suggestions(self):
+        blender = self.fit(['a', 'bb', 'b', 'ccc', 'dddddd'])
+        signals = blender.signals()
+        self.assertEqual([row[0] for row in signals], [1, 2, 3])
+        self.assertEqual([row[1] for row in signals], [1, 1, 1])
+        self.assertEqual(signals[0][4:], (None, None, None))
+        self.assertEqual(blender.suggest(1)[0][0], 1)
+
+    def test_relative_gaps_of_integer_cutoffs(self):
+        chain = {('a', 'b'): 0, ('b', 'c'): 2, ('c', 'd'): 4, ('d', 'e'): 7}
+        distance = lambda a, b: chain.get(tuple(sorted((a, b))), 100)
+        blender = mergic.Blender(distance, cache_dir=None).fit(list('abcde'))
+        self.assertEqual([row[:2] for row in blender.signals()],
+                         [(0, 1.0), (2, 1.0), (4, 1.5)])
+
+    def test_suggests_best_f1_against_truth(self):
+        blender = self.fit(['a', 'bb', 'b', 'ccc', 'dddddd'])
+        truth = {'x': ['a', 'b', 'bb', 'ccc']}
+        best = blender.suggest(1, truth)[0]
+        self.assertEqual(best[0], 2)
+        self.assertEqual(best[4:], (1.0, 1.0, 1.0))
+
+    def test_uses_cache_object(self):
+        cache = {}
+        blender = mergic.Blender(self.distance, cache_dir=self.cache_dir)
+        blender.fit(['a', 'b', 'c'], cache)
+        del self.calls[:]
+        blender.fit(['a', 'b', 'c'], cache)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_skips_cache_for_opaque_distance(self):
+        with open(os.devnull) as f:
+            blender = mergic.Blender(lambda a, b: f.closed + (a != b),
+                                     cache_dir=self.cache_dir)
+            blender.fit(['a', 'b', 'c'])
+        self.assertEqual(blender.summary(), [(3, 1, 0, 0), (1, 3, 3, 1)])
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_caches_unicode_items(self):
+        items = [u'Jos\xe9', u'Jose', u'Joe']
+        first = self.fit(items).partition(1)
+        del self.calls[:]
+        blender = self.fit(items)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(blender.partition(1), first)
+        self.assertEqual(set(map(type, blender.ordered_items)), set([unicode]))
+
+    def test_numbers_arent_cached(self):
+        blender = mergic.Blender(lambda a, b: abs(a - b), key_method=max,
+                                 cache_dir=self.cache_dir)
+        self.assertEqual(blender.fit([1, 2, 10]).partition(1),
+                         {2: [1, 2], 10: [10]})
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_skips_cache_for_distance_holding_its_blender(self):
+        class Service(object):
+            def __init__(self, cache_dir):
+                self.blender = mergic.Blender(self.distance,
+                                              cache_dir=cache_dir)
+
+            def distance(self, a, b):
+                return int(a != b)
+        blender = Service(self.cache_dir).blender.fit(['a', 'b', 'a'])
+        self.assertEqual(blender.summary(), [(2, 1, 0, -1), (2, 1, 0, 0),
+                                             (1, 2, 1, 1)])
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_cached_summary_keeps_distance_types(self):
+        distance = lambda a, b: 0 if a == b else 0.5
+        blender = mergic.Blender(distance, cache_dir=self.cache_dir)
+        cold = blender.fit(['a', 'a', 'b']).summary()
+        warm = blender.fit(['a', 'a', 'b']).summary()
+        self.assertEqual([map(type, row) for row in warm],
+                         [map(type, row) for row in cold])
+
+    def test_update_matches_full_calculation(self):
+        items = ['ab', 'abc', 'b', 'ab', 'bcd', 'a', 'abc', 'bc', 'c']
+        fresh = mergic.Blender(self.distance, cache_dir=None).fit(items)
+        self.fit(items[:5])
+        updated = self.fit(items, True)
+        self.assertEqual(updated.cutoffs, fresh.cutoffs)
+        self.assertEqual(updated.merges, fresh.merges)
+        self.assertEqual(updated.ordered_items, fresh.ordered_items)
+
+    def test_spilling_repeated_lines_matches_full_calculation(self):
+        items = ['ab', 'abc', 'b', 'bcd', 'a', 'bc', 'c'] * 3
+        fresh = mergic.Blender(self.distance, cache_dir=None).fit(items)
+        stats = mergic.Stats()
+        spilled = mergic.Blender(self.distance, cache_dir=None, stats=stats,
+                                 memory_budget=3 * mergic.bytes_per_link)
+        spilled.fit(items)
+        self.assertTrue(stats.counts['spilled_runs'] > 1)
+        self.assertEqual(spilled.cutoffs, fresh.cutoffs)
+        self.assertEqual(spilled.merges, fresh.merges)
+        self.assertEqual(spilled.ordered_items, fresh.ordered_items)
+
+    def test_spilling_streams_blocked_pairs(self):
+        items = ['ab', 'abc', 'b', 'ab', 'bcd', 'a', 'abc', 'bc', 'c']
+        fresh = mergic.Blender(self.distance, blocker='ngram',
+                               cache_dir=None).fit(items)
+
+        def blocker(unique):
+            raise AssertionError('pairs should be found by column')
+        blocker.columns = mergic.ngram_columns
+        spilled = mergic.Blender(self.distance, blocker=blocker,
+                                 cache_dir=None,
+                                 memory_budget=3 * mergic.bytes_per_link)
+        spilled.fit(items)
+        self.assertEqual(spilled.cutoffs, fresh.cutoffs)
+        self.assertEqual(spilled.merges, fresh.merges)
+        self.assertEqual(spilled.ordered_items, fresh.ordered_items)
+
+    def test_update_recalculates_for_distance_fit_to_all_items(self):
+        items = ['abc', 'abd', 'xbc', 'abc', 'xyz', 'abz', 'xbd']
+        fresh = mergic.Blender('tfidf_cosine', cache_dir=None).fit(items)
+        mergic.Blender('tfidf_cosine', cache_dir=self.cache_dir).fit(items[:4])
+        stats = mergic.Stats()
+        updated = mergic.Blender('tfidf_cosine', cache_dir=self.cache_dir,
+                                 stats=stats).fit(items, update=True)
+        self.assertNotIn('cache_updates', stats.counts)
+        self.assertEqual(updated.cutoffs, fresh.cutoffs)
+        self.assertEqual(updated.merges, fresh.merges)
+
+    def test_update_recalculates_for_neighborhood_blocker(self):
+        # The new items sort between the old ones, which stop being
+        # neighbors.
+        items = ['a', 'z'] + ['m%d' % i for i in range(10)]
+        fresh = mergic.Blender(self.distance, blocker='neighborhood',
+                               cache_dir=None).fit(items)
+        blender = mergic.Blender(self.distance, blocker='neighborhood',
+                                 cache_dir=self.cache_dir)
+        blender.fit(items[:2])
+        updated = blender.fit(items, update=True)
+        self.assertEqual(updated.cutoffs, fresh.cutoffs)
+        self.assertEqual(updated.merges, fresh.merges)
+
+    def test_spilling_to_disk_matches_full_calculation(self):
+        items = ['ab', 'abc', 'b', 'ab', 'bcd', 'a', 'abc', 'bc', 'c']
+        fresh = mergic.Blender(self.distance, cache_dir=None).fit(items)
+        stats = mergic.Stats()
+        spilled = mergic.Blender(self.distance, cache_dir=None, stats=stats,
+                                 memory_budget=3 * mergic.bytes_per_link)
+        spilled.fit(items)
+        self.assertTrue(stats.counts['spilled_runs'] > 1)
+        self.assertEqual(spilled.steps, fresh.steps)
+        self.assertEqual(spilled.cutoffs, fresh.cutoffs)
+        self.assertEqual(spilled.merges, fresh.merges)
+        self.assertEqual(spilled.ordered_items, fresh.ordered_items)
+
+    def test_update_only_calculates_new_pairs(self):
+        items = ['a', 'b', 'c', 'd', 'e']
+        self.fit(items[:4])
+        del self.calls[:]
+        self.fit(items, True)
+        self.assertEqual(len(self.calls), 4)
+
+    def test_bounded_calculation_matches_partition(self):
+        items = ['ab', 'abc', 'b', 'ab', 'bcd', 'a', 'abc', 'bc', 'c']
+        fresh = mergic.Blender(self.distance, cache_dir=None).fit(items)
+        bounded = mergic.Blender(self.distance, cache_dir=self.cache_dir,
+                                 max_distance=1).fit(items)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        for cutoff in [0, 1]:
+            self.assertTrue(mergic.equal(fresh.partition(cutoff),
+                                         bounded.partition(cutoff)))
+
+    def test_stats_count_calls_and_cache(self):
+        items = ['a', 'b', 'c', 'd']
+        stats = mergic.Stats()
+        blender = mergic.Blender(self.distance, cache_dir=self.cache_dir,
+                                 stats=stats)
+        for run in range(2):
+            blender.fit(items)
+        self.assertEqual(stats.counts['distance_calls'], 6)
+        self.assertEqual(stats.counts['cache_misses'], 1)
+        self.assertEqual(stats.counts['cache_hits'], 1)
+        self.assertEqual(sum(stats.latencies.values()), 6)
+
+    def test_updated_entry_is_cached(self):
+        items = ['a', 'b', 'c']
+        self.fit(items[:2])
+        self.fit(items, True)
+        del self.calls[:]
+        self.fit(items)
+        self.assertEqual(self.calls, [])
+
+
+class TestIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.distance = mergic.LevenshteinDistance()
+        self.items = ['kitten', 'sitting', 'mitten', 'fitting', 'kit',
+                      'sitter', 'bitten', 'smitten']
+
+    def test_bktree_finds_same_nearest_as_scan(self):
+        scan = mergic.ScanIndex(self.distance)
+        tree = mergic.BKTree(self.distance)
+        for item in self.items:
+            scan.add(item)
+            tree.add(item)
+        for item in ['kitten', 'sittin', 'mitt', 'xyz', 'bitter']:
+            for cutoff in [0, 1, 2, 10]:
+                self.assertEqual(tree.nearest(item, cutoff),
+                                 scan.nearest(item, cutoff))
+
+    def test_nearest_ties_go_to_earliest_member(self):
+        index = mergic.ScanIndex(self.distance)
+        for item in ['ab', 'ba', 'bb']:
+            index.add(item)
+        self.assertEqual(index.nearest('bb', 1), (0, 2))
+        self.assertEqual(index.nearest('aa', 1), (1, 0))
+
+    def test_ngram_index_only_compares_sharing_members(self):
+        index = mergic.NgramIndex(self.distance)
+        for item in self.items:
+            index.add(item)
+        self.assertEqual(index.candidates('kit'), [0, 4])
+
+    def test_bktree_needs_metric_distance(self):
+        with self.assertRaises(ValueError):
+            mergic.BKTree(mergic.StockDistance())
+
+
+class TestServe(unittest.TestCase):
+
+    def setUp(self):
+        blender = mergic.Blender('levenshtein', cache_dir=None)
+        blender.fit(['Bob', 'Bobby', 'Alice', 'Alicia'])
+        self.server = mergic.make_server(('127.0.0.1', 0), blender,
+                                         quiet=True)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def get(self, path, data=None):
+        return urllib2.urlopen(self.url + path, data).read()
+
+    def test_summary(self):
+        summary = json.loads(self.get('/summary'))
+        self.assertEqual(summary['rows'], [[4, 1, 0, 1], [2, 2, 2, 2],
+                                           [1, 4, 6, 5]])
+
+    def test_partition_is_made_once_per_grouping(self):
+        self.assertEqual(json.loads(self.get('/partition?cutoff=2.5')),
+                         {'Bobby': ['Bob', 'Bobby'],
+                          'Alicia': ['Alice', 'Alicia']})
+        self.get('/partition?cutoff=3')
+        self.assertEqual(len(self.server.partitions.cache), 1)
+
+    def test_diff_and_apply(self):
+        edited = '{"Bob": ["Bob", "Bobby", "Alice"], "Alicia": ["Alicia"]}'
+        patch = self.get('/diff?cutoff=2', edited)
+        self.assertEqual(json.loads(patch),
+                         {'Bob': ['Bob', 'Bobby', 'Alice'],
+                          'Alicia': ['Alicia']})
+        patched = json.loads(self.get('/apply?cutoff=2', patch))
+        self.assertEqual(patched, json.loads(edited))
+
+    def test_bad_request(self):
+        with self.assertRaises(urllib2.HTTPError) as caught:
+            self.get('/partition')
+        self.assertEqual(caught.exception.code, 400)
+
+
+class TestAssign(unittest.TestCase):
+
+    def setUp(self):
+        self.blender = mergic.Blender('levenshtein')
+        self.partition = {'Bob': ['Bob', 'Bobby'], 'Alice': ['Alice']}
+
+    def test_joins_nearest_group_or_starts_new_one(self):
+        patch = self.blender.assign(self.partition,
+                                    ['Alicia', 'Zed', 'Bob'], 2)
+        self.assertEqual(patch.items(), [('Alice', ['Alice', 'Alicia']),
+                                         ('Zed', ['Zed'])])
+
+    def test_new_items_can_join_each_other(self):
+        patch = self.blender.assign(self.partition, ['Zed', 'Zeds'], 1)
+        self.assertEqual(patch, {'Zed': ['Zed', 'Zeds']})
+
+    def test_patch_applies_with_new_values(self):
+        patch = self.blender.assign(self.partition, ['Bobb', 'Zed'], 1)
+        mergic.apply_diff(self.partition, patch, allow_new=True)
+        self.assertEqual(self.partition, {'Bob': ['Bob', 'Bobby', 'Bobb'],
+                                          'Alice': ['Alice'],
+                                          'Zed': ['Zed']})
+
+    def test_indexes_agree(self):
+        items = ['Bobbi', 'Alic', 'Zed', 'Zedd', 'Bo']
+        patches = [self.blender.assign(self.partition, items, 2, index)
+                   for index in ['scan', 'ngram', 'bktree']]
+        self.assertEqual(patches[0], patches[1])
+        self.assertEqual(patches[0], patches[2])
+
+
 class TestDiff(unittest.TestCase):
 
     def test_no_diff_when_same(self):
@@ -67,6 +989,55 @@ class TestDiff(unittest.TestCase):
                                      {1: [1], 2: [2], 3: [3]}),
                          {1: [1], 2: [2]})
 
+    def test_patch_keeps_order_of_second(self):
+        first = {1: [1], 2: [2], 3: [3]}
+        second = OrderedDict([(3, [3, 1]), (2, [2])])
+        self.assertEqual(mergic.diff(first, second).keys(), [3])
+        second = OrderedDict([(9, [3]), (8, [2, 1])])
+        self.assertEqual(mergic.diff(first, second).keys(), [9, 8])
+
+    def test_doesnt_change_arguments(self):
+        first = {1: [1, 2], 3: [3]}
+        second = {1: [1], 2: [2, 3]}
+        mergic.diff(first, second)
+        self.assertEqual(first, {1: [1, 2], 3: [3]})
+        self.assertEqual(second, {1: [1], 2: [2, 3]})
+
+
+class TestApplyDiff(unittest.TestCase):
+
+    def test_applying_diff_gives_second(self):
+        first = {1: [1, 2], 3: [3], 4: [4, 5]}
+        second = {1: [1], 2: [2, 3], 4: [4, 5]}
+        patch = mergic.diff(first, second)
+        mergic.apply_diff(first, patch)
+        self.assertTrue(mergic.equal(first, second))
+
+    def test_raises_on_value_not_in_partition(self):
+        with self.assertRaises(ValueError):
+            mergic.apply_diff({1: [1]}, {1: [1, 2]})
+
+    def test_streams_unchanged_groups_first(self):
+        groups = [(1, [1]), (2, [2, 3]), (4, [4])]
+        patch = {2: [2], 3: [3]}
+        self.assertEqual(list(mergic.apply_groups(groups, patch))[:2],
+                         [(1, [1]), (4, [4])])
+
+    def test_raises_when_patched_key_would_lose_values(self):
+        with self.assertRaises(ValueError):
+            list(mergic.apply_groups([(1, [1]), (2, [2])], {1: [2]}))
+
+    def test_adds_new_values_when_allowed(self):
+        partition = {1: [1], 2: [2]}
+        mergic.apply_diff(partition, {2: [2, 3], 4: [4]}, allow_new=True)
+        self.assertEqual(partition, {1: [1], 2: [2, 3], 4: [4]})
+
+    def test_unchanged_when_raising(self):
+        partition = {1: [1], 2: [2, 3]}
+        with self.assertRaises(ValueError):
+            mergic.apply_diff(partition, {1: [1, 2]})
+        self.assertEqual(partition, {1: [1], 2: [2, 3]})
+
 
 class TestEqual(unittest.TestCase):
 
@@ -100,6 +1071,9 @@ class TestEqual(unittest.TestCase):
 
 class TestTable(unittest.TestCase):
 
+    groups = [(u'Serena Williams', [u'S Williams', u'Serena Williams']),
+              (u'Jos\xe9', [u'Jose', u'Jos\xe9'])]
+
     def test_nothing_for_empty(self):
         self.assertEqual(len(list(mergic.table({}))), 0)
 
@@ -112,6 +1086,109 @@ class TestTable(unittest.TestCase):
         rowset = set([(2, 1), (3, 1), (4, 'b'), (5, 'b'), (6, 'b')])
         self.assertEqual(set(mergic.table(p)), rowset)
 
+    def test_rows_follow_position_index(self):
+        p = {1: [2, 3], 'b': [4, 5, 6]}
+        position = {5: 0, 3: 1, 2: 2, 4: 3}
+        self.assertEqual([row[0] for row in mergic.table(p, position)],
+                         [5, 3, 2, 4, 6])
+
+    def test_writes_rows_in_partition_order(self):
+        out = io.BytesIO()
+        mergic.write_table(self.groups, out)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['original,mergic',
+                          'S Williams,Serena Williams',
+                          'Serena Williams,Serena Williams',
+                          'Jose,Jos\xc3\xa9',
+                          'Jos\xc3\xa9,Jos\xc3\xa9'])
+
+    def test_writes_across_batches(self):
+        out = io.BytesIO()
+        rows = [[str(i), 'x'] for i in range(10)]
+        mergic.write_batches(mergic.batched(rows, 3), out, buffer_size=8)
+        self.assertEqual(out.getvalue(), ''.join('{},x\r\n'.format(i)
+                                                 for i in range(10)))
+
+    def test_join_adds_keys(self):
+        rows = [['id', 'name'], ['1', 'Jose'], ['2', 'Nobody'],
+                ['3', 'S Williams']]
+        self.assertEqual(list(mergic.join(self.groups, rows, 'name')),
+                         [['id', 'name', 'mergic'],
+                          ['1', 'Jose', 'Jos\xc3\xa9'],
+                          ['2', 'Nobody', ''],
+                          ['3', 'S Williams', 'Serena Williams']])
+
+    def test_join_raises_on_missing_column(self):
+        with self.assertRaises(ValueError):
+            list(mergic.join(self.groups, [['id']], 'name'))
+
+
+class TestScript(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def run_script(self, args, data):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'mergic.py')
+        process = subprocess.Popen(
+            [sys.executable, path] + args + ['--cache-dir', self.cache_dir],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return process.communicate(data)[0]
+
+    def test_make_reads_standard_input_with_only_a_cutoff(self):
+        data = 'Lance Burton\nLevar Burton\nDavid Copperfield\n'
+        partition = json.loads(self.run_script(['make', '0.3'], data))
+        self.assertEqual(partition, {'Lance Burton': ['Lance Burton',
+                                                      'Levar Burton'],
+                                     'David Copperfield':
+                                         ['David Copperfield']})
+
+    def test_make_rejects_bad_cutoffs(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'mergic.py')
+        for cutoffs in ['0.1,abc', '0.3,0.30']:
+            process = subprocess.Popen(
+                [sys.executable, path, 'make', '--cutoffs', cutoffs,
+                 '--outdir', os.path.join(self.cache_dir, 'out')],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+            error = process.communicate('a\nb\n')[1]
+            self.assertEqual(process.returncode, 2)
+            self.assertIn('argument --cutoffs', error)
+
+    def test_update_with_distance_replaced_under_preprocessing(self):
+        script = os.path.join(self.cache_dir, 'script.py')
+        with open(script, 'w') as f:
+            f.write('import sys\n'
+                    'sys.path.insert(0, {!r})\n'
+                    'import mergic\n'
+                    'def lower(item):\n'
+                    '    return item.lower()\n'
+                    "mergic.Blender('levenshtein', preprocess=lower)"
+                    '.script()\n'.format(os.path.dirname(
+                        os.path.abspath(__file__))))
+        lines = ['abc', 'abd', 'xbc', 'abc', 'xyz', 'abz', 'xbd']
+        paths = []
+        for name, count in [('part.txt', 4), ('full.txt', 7)]:
+            paths.append(os.path.join(self.cache_dir, name))
+            with open(paths[-1], 'w') as f:
+                f.write('\n'.join(lines[:count]) + '\n')
+
+        def calc(path, cache_dir, *args):
+            return subprocess.check_output(
+                [sys.executable, script, 'calc', '--distance',
+                 'tfidf_cosine', path, '--cache-dir', cache_dir] +
+                list(args))
+        updates = os.path.join(self.cache_dir, 'updates')
+        calc(paths[0], updates)
+        updated = calc(paths[1], updates, '--update')
+        fresh = calc(paths[1], os.path.join(self.cache_dir, 'fresh'))
+        self.assertEqual(updated, fresh)
+
 
 if __name__ == '__main__':
     unittest.main()
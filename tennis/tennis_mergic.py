@@ -11,10 +11,6 @@ def first_initial_last(name):
     return "{}. {}".format(initial, last)
 
 
-def distance(x, y):
-    x = first_initial_last(x)
-    y = first_initial_last(y)
-    return Levenshtein.distance(x, y)
-
-
-mergic.Blender(distance).script()
+mergic.Blender(Levenshtein.distance,
+               preprocess=first_initial_last,
+               memo=True).script()